@@ -1,11 +1,314 @@
-import contract_parser,messenger
+"""
+Entry point for a contract management run.  run() executes the program as
+a chain of stages, each producing its artifacts exactly once and handing
+them to the next:
+
+    load --> compute --> partition --> render workbooks --> render memos
+         --> deliver --> clean
+
+and prints the wall time of every stage and the run's counters when it
+completes, see the metrics module for the JSON and Prometheus reports.  In
+changes only mode the contracts reported are limited to those that changed
+since they were last notified, see the state module.  With a contract
+store the formulas and watchlists are evaluated as indexed SQL queries, see
+the contract_store module.  With a snapshot history the burn rate trends
+between runs are added and reported on the trend watchlists, see the
+history module.  With forecast amounts the change order memos request the
+amount each contract needs to stay funded until its end date under the
+forecast scenarios, see the forecast module.  run_batch() does the same for
+a folder of agency workbooks evaluated in parallel, see the batch module.
+
+    $ python app.py --help
+"""
+import argparse
+import os
+
+import numpy as np
+
+import batch,calculations,contract_parser,contract_store,forecast,history,messenger,metrics,\
+       state,wiper
+
+def _count_reports(run_metrics, contracts, workbooks, memos,
+                   watchlists=contract_parser.WATCHLISTS):
+    """
+    Add the contracts flagged and the files written to the run's counters.
+    """
+    flagged = np.zeros(len(contracts), dtype=bool)
+    for condition in watchlists.values():
+        flagged |= np.asarray(condition(contracts), dtype=bool)
+    run_metrics.count('contracts_flagged', int(flagged.sum()))
+    run_metrics.count('files_written', len(workbooks) + len(memos))
+    run_metrics.count('bytes_written', sum(os.path.getsize(file) for file in workbooks + memos))
+
+def _count_delivery(run_metrics, results):
+    """
+    Add the messages sent, failures, retries and attachment bytes sent of a
+    list of delivery.DeliveryResult to the run's counters.
+    """
+    run_metrics.count('messages_sent', sum(result.sent for result in results))
+    run_metrics.count('send_failures', sum(not result.sent for result in results))
+    run_metrics.count('send_retries', sum(result.attempts - 1 for result in results))
+    run_metrics.count('bytes_sent', sum(os.path.getsize(file) for result in results
+                                        if result.sent for file in result.files))
+
+def run(book=None, combined_memos=False, workers=None, concurrency=None, retries=None,
+        deliver=True, changes_only=False, state_path=state.STATE_DB, store=None,
+        forecast_amounts=False, trends=None, run_metrics=None):
+    """
+    Function runs the contract management program once for a ContractBook
+    (default calculations.default_book): it computes the indicators, writes
+    the division watchlist workbooks and change order memos, emails them and
+    cleans the sent workbooks and memos from their folders, applying the
+    retention limits of wiper.ArtifactManager.
+
+    optional arguments:
+        combined_memos --> bool  (render the memos as one pdf, see
+                                  contract_parser.generate_combined_memo)
+        workers        --> int   (processes for writing workbooks and memos)
+        concurrency    --> int   (emails in flight at once)
+        retries        --> int   (further attempts for a failed email)
+        deliver        --> bool  (False renders the reports without emailing
+                                  or cleaning them)
+        changes_only   --> bool  (report only contracts that are new or
+                                  changed since last notified, and record
+                                  those delivered in the state database at
+                                  state_path)
+        store          --> str   (evaluate the contracts in a
+                                  contract_store.ContractStore at this path,
+                                  ':memory:' for a temporary one)
+        forecast_amounts --> bool (request the change order amounts of
+                                  forecast.change_order_amounts() in the
+                                  memos instead of 10% of the limit)
+        trends         --> str   (append the contracts to the
+                                  history.SnapshotStore in this folder and
+                                  add the trend watchlists of
+                                  contract_parser.TREND_WATCHLISTS)
+        run_metrics    --> metrics.RunMetrics (records the stages and
+                                  counters, default a new one)
+
+    Function returns an ordered dict of stage name --> seconds.
+    """
+    book = calculations.default_book if book is None else book
+    run_metrics = metrics.RunMetrics() if run_metrics is None else run_metrics
+
+    with run_metrics.stage('load'):
+        book.raw
+    run_metrics.count('rows_loaded', len(book.raw))
+    with run_metrics.stage('compute'):
+        if store is None:
+            contracts = book.computed
+        else:
+            contract_db = contract_store.ContractStore(store)
+            contract_db.load(book.fiscal)
+            contracts = contract_db.computed()
+    run_metrics.count('contracts_active', len(contracts))
+    watchlists = contract_parser.WATCHLISTS
+    if trends is not None:
+        with run_metrics.stage('trends'):
+            contracts = history.SnapshotStore(trends).append(contracts)
+        watchlists = contract_parser.ALL_WATCHLISTS
+    if changes_only:
+        notified = state.ContractState(state_path)
+        total = len(contracts)
+        with run_metrics.stage('diff state'):
+            contracts = notified.changed(contracts)
+        run_metrics.count('contracts_changed', len(contracts))
+        print('{} of {} contracts changed since last notified'.format(len(contracts), total))
+    with run_metrics.stage('partition'):
+        if store is None or changes_only or trends is not None:
+            partitions = contract_parser.partition_watchlists(contracts, watchlists)
+        else:
+            partitions = contract_db.partitions()
+    with run_metrics.stage('render workbooks'):
+        workbooks = contract_parser.generate_watchlist_workbooks(partitions=partitions,
+                                                                 workers=workers)
+    amounts = None
+    if forecast_amounts:
+        with run_metrics.stage('forecast'):
+            amounts = forecast.change_order_amounts(contracts)
+    with run_metrics.stage('render memos'):
+        memo_count = len(contract_parser.memo_arguments(contracts, amounts=amounts))
+        if not memo_count:
+            memos = []
+        elif combined_memos:
+            memos = [contract_parser.generate_combined_memo(contracts=contracts,
+                                                            amounts=amounts)]
+        else:
+            memos = contract_parser.generate_pdfs(contracts=contracts, workers=workers,
+                                                  amounts=amounts)
+    run_metrics.count('memos', memo_count)
+    _count_reports(run_metrics, contracts, workbooks, memos, watchlists)
+
+    if deliver:
+        with run_metrics.stage('deliver'):
+            results = messenger.deliver_reports(workbooks, memos, memo_count=memo_count,
+                                                concurrency=concurrency, retries=retries)
+        _count_delivery(run_metrics, results)
+        with run_metrics.stage('clean'):
+            artifacts = wiper.ArtifactManager.from_config(messenger.load_config())
+            artifacts.record(generated=workbooks + memos)
+            artifacts.record_deliveries(results)
+            artifacts.clean()
+        if changes_only:
+            with run_metrics.stage('record state'):
+                notified.record(delivered_contracts(contracts, results, memos))
+    if changes_only:
+        notified.close()
+    if store is not None:
+        contract_db.close()
+
+    run_metrics.stop()
+    run_metrics.print_summary()
+    return run_metrics.timings()
+
+def run_batch(source, combined_memos=False, workers=None, concurrency=None, retries=None,
+              deliver=True, sheet='master', idx_col='MB START', forecast_amounts=False,
+              trends=None, run_metrics=None):
+    """
+    Function runs the contract management program for every agency workbook
+    in source, a folder or glob pattern (see batch.agency_workbooks()).  The
+    workbooks are evaluated in parallel into one contracts frame tagged with
+    the agency, then each agency's watchlist workbooks and change order memos
+    are written to its own subfolder of 'temporary_workbooks_folder' and
+    'changeorder_memos' and emailed with the agency in the subjects.  With
+    trends each agency keeps its snapshot history in its own subfolder.
+    Sent files are cleaned once every agency is done.  Arguments are as for
+    run().
+
+    Function returns the merged contracts frame.
+    """
+    run_metrics = metrics.RunMetrics() if run_metrics is None else run_metrics
+    artifacts = wiper.ArtifactManager.from_config(messenger.load_config())
+    with run_metrics.stage('evaluate agencies'):
+        contracts = batch.evaluate_agencies(batch.agency_workbooks(source), workers=workers,
+                                            sheet=sheet, idx_col=idx_col)
+    run_metrics.count('contracts_active', len(contracts))
+    print('{} contracts from {} agencies'.format(len(contracts),
+                                                 contracts['agency'].nunique()))
+
+    for agency, agency_contracts in contracts.groupby('agency', sort=False, observed=True):
+        workbook_folder = os.path.join('temporary_workbooks_folder', agency)
+        memo_folder = os.path.join('changeorder_memos', agency)
+        watchlists = contract_parser.WATCHLISTS
+        if trends is not None:
+            with run_metrics.stage('trends'):
+                agency_contracts = history.SnapshotStore(
+                    os.path.join(trends, agency)).append(agency_contracts)
+            watchlists = contract_parser.ALL_WATCHLISTS
+        with run_metrics.stage('{} reports'.format(agency)):
+            workbooks = contract_parser.generate_watchlist_workbooks(
+                partitions=contract_parser.partition_watchlists(agency_contracts, watchlists),
+                workers=workers, folder=workbook_folder)
+            amounts = (forecast.change_order_amounts(agency_contracts)
+                       if forecast_amounts else None)
+            memo_count = len(contract_parser.memo_arguments(agency_contracts, amounts=amounts))
+            if not memo_count:
+                memos = []
+            elif combined_memos:
+                memos = [contract_parser.generate_combined_memo(contracts=agency_contracts,
+                                                                folder=memo_folder,
+                                                                amounts=amounts)]
+            else:
+                memos = contract_parser.generate_pdfs(contracts=agency_contracts,
+                                                      workers=workers, folder=memo_folder,
+                                                      amounts=amounts)
+        run_metrics.count('memos', memo_count)
+        _count_reports(run_metrics, agency_contracts, workbooks, memos, watchlists)
+        artifacts.record(generated=workbooks + memos)
+        if deliver:
+            with run_metrics.stage('{} deliver'.format(agency)):
+                results = messenger.deliver_reports(workbooks, memos, memo_count=memo_count,
+                                                    concurrency=concurrency, retries=retries,
+                                                    agency=agency)
+            _count_delivery(run_metrics, results)
+            artifacts.record_deliveries(results)
+    if deliver:
+        with run_metrics.stage('clean'):
+            artifacts.clean()
+
+    run_metrics.stop()
+    run_metrics.print_summary()
+    return contracts
+
+def delivered_contracts(contracts, results, memos):
+    """
+    Function returns the contracts whose reports all went out: the email
+    with their division's watchlist workbook was sent and, for high burning
+    contracts, so were the change order memos.  results is the list of
+    delivery.DeliveryResult returned by messenger.deliver_reports().  A file
+    counts as delivered only when a sent message carried it, so a division
+    whose workbook failed to render is not recorded as notified.
+    """
+    sent = set(file for result in results if result.sent for file in result.files)
+    workbook_sent = contracts['division'].map(contract_parser.watchlist_filename).isin(sent)
+    memos_sent = sent.issuperset(memos)
+    return contracts[workbook_sent & (memos_sent | (contracts['burn_status'] != 'high'))]
 
 
 if __name__ == '__main__':
-    deliver_reports = messenger.send_emails()
-    create_memos = contract_parser.generate_pdfs()
-    try:
-        deliver_reports
-        create_memos
-    except:
-        pass
+    parser = argparse.ArgumentParser(description='Run contract management reports.')
+    parser.add_argument('--workbook', default=calculations.DEFAULT_WORKBOOK,
+                        help='contract list workbook to evaluate (default: %(default)s)')
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help='evaluate every agency workbook in this folder or glob pattern '
+                             'instead of --workbook, one process per workbook')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='parse the contract workbook again instead of using its cached copy')
+    parser.add_argument('--streaming', action='store_true',
+                        help='read only the active contracts and needed columns row by row')
+    parser.add_argument('--combined-memos', action='store_true',
+                        help='email the change order memos as one pdf instead of one file per memo')
+    parser.add_argument('--workers', type=int,
+                        help='processes used to write workbooks and memos')
+    parser.add_argument('--concurrency', type=int,
+                        help='emails delivered at once (default: [SMTP] concurrency or 5)')
+    parser.add_argument('--retries', type=int,
+                        help='further attempts for a failed email (default: [SMTP] retries or 3)')
+    parser.add_argument('--no-deliver', action='store_true',
+                        help='write the reports without emailing them')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='report only contracts new or changed since they were last notified')
+    parser.add_argument('--state', default=state.STATE_DB,
+                        help='contract state database for --changes-only (default: %(default)s)')
+    parser.add_argument('--store', nargs='?', const=contract_store.STORE_DB,
+                        help='evaluate the contracts as SQL in this SQLite store '
+                             '(default when given: %(const)s, :memory: for a temporary one)')
+    parser.add_argument('--forecast-amounts', action='store_true',
+                        help='request the change order each contract needs to stay funded '
+                             'under the forecast scenarios instead of 10%% of its limit')
+    parser.add_argument('--trends', nargs='?', const=history.HISTORY_DIR, metavar='FOLDER',
+                        help='keep a snapshot history in this folder and report the burn rate '
+                             'trend watchlists (default when given: %(const)s)')
+    parser.add_argument('--report', metavar='PATH',
+                        help='save the stage timings, memory and counters as JSON')
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help='save the run metrics as a Prometheus textfile (.prom)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='profile the run with cProfile and save the statistics')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure the peak python memory of every stage with tracemalloc')
+    args = parser.parse_args()
+
+    run_metrics = metrics.RunMetrics(trace_memory=args.trace_memory,
+                                     profile=bool(args.profile))
+    if args.batch:
+        run_batch(args.batch, combined_memos=args.combined_memos, workers=args.workers,
+                  concurrency=args.concurrency, retries=args.retries,
+                  deliver=not args.no_deliver, forecast_amounts=args.forecast_amounts,
+                  trends=args.trends, run_metrics=run_metrics)
+    else:
+        calculations.default_book = calculations.ContractBook(args.workbook,
+                                                              refresh_cache=args.refresh_cache,
+                                                              streaming=args.streaming)
+        run(combined_memos=args.combined_memos, workers=args.workers,
+            concurrency=args.concurrency, retries=args.retries, deliver=not args.no_deliver,
+            changes_only=args.changes_only, state_path=args.state, store=args.store,
+            forecast_amounts=args.forecast_amounts, trends=args.trends,
+            run_metrics=run_metrics)
+
+    if args.report:
+        run_metrics.write_json(args.report)
+    if args.prometheus:
+        run_metrics.write_prometheus(args.prometheus)
+    if args.profile:
+        run_metrics.write_profile(args.profile)
@@ -0,0 +1,95 @@
+"""
+Module for evaluating the contract ledgers of several agencies in one run.
+Each agency keeps its contract list in its own workbook, named for the
+agency, for example:
+    ledgers/DGS.xlsx
+    ledgers/DPW.xlsx
+
+The workbooks are read and evaluated in parallel, one process per workbook,
+each with its own calculations.ContractBook, and the results are merged into
+a single contracts frame with an 'agency' column.  See app.run_batch() for
+producing and emailing the per agency reports from it.
+"""
+import glob
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# custom module for running DGS contract management formulas
+import calculations
+# custom module for preparing and returning relevant DGS dataframes
+import fetcher
+
+def agency_workbooks(source):
+    """
+    Function takes a folder or a glob pattern of workbooks and returns an
+    ordered dict of agency --> workbook path, the agency being the workbook
+    filename without its extension.  Excel lock files (~$...) are skipped.
+    """
+    pattern = os.path.join(source, '*.xlsx') if os.path.isdir(source) else source
+    workbooks = OrderedDict()
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.basename(path)
+        if not name.startswith('~$'):
+            workbooks[os.path.splitext(name)[0]] = path
+    return workbooks
+
+def evaluate_workbook(agency, filepath, sheet='master', idx_col='MB START'):
+    """
+    Function returns the computed contracts of one agency workbook tagged
+    with the agency in an 'agency' column.
+    """
+    contracts = calculations.ContractBook(filepath, sheet=sheet, idx_col=idx_col).computed
+    contracts.insert(0, 'agency', agency)
+    return contracts
+
+def _evaluate(args):
+    """
+    Unpack a tuple of evaluate_workbook() arguments, for use with a process pool.
+    """
+    return evaluate_workbook(*args)
+
+def evaluate_agencies(workbooks, workers=None, sheet='master', idx_col='MB START'):
+    """
+    Function evaluates every workbook in workbooks, an ordered dict of agency
+    --> workbook path as returned by agency_workbooks(), in a pool of workers
+    processes (default one per workbook, at most os.cpu_count()).  An agency
+    whose workbook fails is reported and left out without stopping the
+    others.
+
+    Function returns the contracts of all agencies in one frame indexed to
+    the master blanket start date, in agency order, with a categorical
+    'agency' column and the compact dtypes of fetcher.SCHEMA and
+    calculations.FORMULA_SCHEMA.
+    """
+    jobs = OrderedDict((agency, (agency, path, sheet, idx_col))
+                       for agency, path in workbooks.items())
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+
+    frames = []
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = OrderedDict((agency, pool.submit(_evaluate, job))
+                                  for agency, job in jobs.items())
+            for agency, future in futures.items():
+                try:
+                    frames.append(future.result())
+                except Exception as e:
+                    print('***{} workbook failed: {}***'.format(agency, e))
+    else:
+        for agency, job in jobs.items():
+            try:
+                frames.append(_evaluate(job))
+            except Exception as e:
+                print('***{} workbook failed: {}***'.format(agency, e))
+    if not frames:
+        return pd.DataFrame(columns=['agency'])
+
+    # categories differ between agencies, so set the dtypes again once merged
+    contracts = pd.concat(frames)
+    contracts['agency'] = pd.Categorical(contracts['agency'],
+                                         categories=pd.unique(contracts['agency']))
+    fetcher.apply_schema(contracts)
+    return fetcher.apply_schema(contracts, calculations.FORMULA_SCHEMA)
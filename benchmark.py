@@ -0,0 +1,495 @@
+"""
+Module for measuring how the contract management program scales with the
+size of the contract ledger.  It builds synthetic contract dataframes shaped
+like the cleaned 'master' sheet and times the calculation formulas on them,
+reporting throughput as rows per second for each ledger size.
+
+run_suite() times and memory profiles every stage of the pipeline, from
+reading a synthetic Contract List workbook to emailing the reports to a
+local SMTP sink, and saves the results as JSON so two versions can be
+compared with compare_results().
+
+Run from the project folder:
+    $ python benchmark.py
+    $ python benchmark.py --suite --sizes 1000 10000 --output bench.json
+    $ python benchmark.py --suite --baseline bench.json
+"""
+import argparse
+import configparser
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime as dt
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import numpy as np
+import pandas as pd
+
+import calculations # custom module for running DGS contract management formulas
+import contract_parser # custom module for parsing target crieteria
+import delivery # concurrent delivery of the division emails
+import fetcher # custom module for preparing and returning relevant DGS dataframes
+import forecast # what-if spending forecasts
+import history # snapshot history and burn rate trends
+import messenger # custom module for emailing the reports
+import transport # pooled SMTP connections and local test server
+
+DIVISIONS = ['Facilities', 'Fleet', 'Energy', 'Real Estate', 'Administration']
+# share of contracts held by each division in synthetic_ledger()
+DIVISION_WEIGHTS = [.35, .25, .15, .15, .10]
+# contract terms in months and how common they are
+TERMS = [12, 24, 36, 48, 60]
+TERM_WEIGHTS = [.20, .25, .30, .10, .15]
+# column headers of the 'master' sheet for the formatted column names
+WORKBOOK_HEADERS = OrderedDict([('po', 'PO'), ('description', 'Description'),
+                                ('vendor', 'Vendor'), ('buyer', 'Buyer'),
+                                ('division', 'Division'), ('mb_end', 'MB End'),
+                                ('mb_$_limit', 'MB $ Limit'), ('mb_$_spent', 'MB $ Spent')])
+
+def synthetic_contracts(rows, seed=0, now=None):
+    """
+    Function returns a dataframe of randomly generated contracts indexed to the
+    master blanket start date with the 'po', 'description', 'division',
+    'mb_end', 'mb_$_limit' and 'mb_$_spent' columns the program depends on.
+    Contracts start up to 5 years before now (default dt.now()) so most are
+    still active.  About 1 in 20 contracts have no spending yet to exercise
+    the zero spend guards.
+    """
+    rng = np.random.RandomState(seed)
+    now = pd.Timestamp(dt.now() if now is None else now).normalize()
+    start = now - pd.to_timedelta(rng.randint(0, 5 * 365, rows), unit='D')
+    end = start + pd.to_timedelta(rng.randint(180, 6 * 365, rows), unit='D')
+    limit = rng.randint(1000, 2000000, rows)
+    spent = (limit * rng.uniform(0, 1.2, rows)).astype(int)
+    spent[rng.uniform(size=rows) < .05] = 0
+    return pd.DataFrame({'po': ['P{:07d}'.format(i) for i in range(rows)],
+                         'description': 'Synthetic contract for benchmarking',
+                         'division': rng.choice(DIVISIONS, rows),
+                         'mb_end': end, 'mb_$_limit': limit, 'mb_$_spent': spent},
+                        index=pd.DatetimeIndex(start, name='MB START'))
+
+def synthetic_ledger(rows, seed=0, now=None):
+    """
+    Function returns a dataframe shaped like the 'master' sheet of the
+    Contract List workbook, with its column headers and indexed to 'MB START',
+    holding rows randomly generated contracts with realistic distributions:
+        start dates     --> uniform over the 6 years before now (default
+                            dt.now()), so about a third have expired
+        terms           --> 1 to 5 years, mostly 2 and 3, a few days either way
+        limits          --> log-normal around $100,000, rounded to $100
+        spend           --> the share of the term elapsed times a log-normal
+                            burn factor, 5% of contracts with no spend yet
+        divisions       --> weighted by DIVISION_WEIGHTS
+        vendors, buyers --> drawn from pools of rows / 20 vendors and 12 buyers
+    """
+    rng = np.random.RandomState(seed)
+    now = pd.Timestamp(dt.now() if now is None else now).normalize()
+    start = now - pd.to_timedelta(rng.randint(0, 6 * 365, rows), unit='D')
+    term = rng.choice(TERMS, rows, p=TERM_WEIGHTS) * 30.44 + rng.randint(-15, 16, rows)
+    end = start + pd.to_timedelta(term.round(), unit='D')
+    limit = np.maximum(np.round(rng.lognormal(np.log(100000), 1.1, rows), -2), 1000)
+    elapsed = np.clip((now - start).days.values / np.asarray(term), 0, 1)
+    spent = np.round(limit * elapsed * rng.lognormal(0, .35, rows), 2)
+    spent[rng.uniform(size=rows) < .05] = 0
+    ledger = pd.DataFrame(OrderedDict([
+        ('po', ['P{:07d}'.format(i) for i in range(rows)]),
+        ('description', rng.choice(['Janitorial services', 'Fleet parts and repair',
+                                    'Electricity supply', 'Lease of office space',
+                                    'HVAC maintenance', 'Office supplies'], rows)),
+        ('vendor', ['Vendor {}'.format(i) for i in rng.randint(0, max(1, rows // 20), rows)]),
+        ('buyer', ['Buyer {}'.format(i) for i in rng.randint(0, 12, rows)]),
+        ('division', rng.choice(DIVISIONS, rows, p=DIVISION_WEIGHTS)),
+        ('mb_end', end), ('mb_$_limit', limit), ('mb_$_spent', spent)]),
+        index=pd.DatetimeIndex(start, name='MB START'))
+    return ledger.rename(columns=WORKBOOK_HEADERS)
+
+def write_synthetic_workbook(filename, rows, seed=0, now=None):
+    """
+    Function saves a synthetic_ledger() of rows contracts as the 'master'
+    sheet of a Contract List workbook at filename and returns filename.
+    """
+    contract_parser.write_watchlist_workbook(
+        filename, OrderedDict([('master', synthetic_ledger(rows, seed=seed, now=now))]))
+    return filename
+
+def benchmark_formulas(sizes=(10000, 100000, 1000000), repeat=3):
+    """
+    Function times run_duration_formulas() followed by run_spending_formulas()
+    on synthetic ledgers of each size and prints the best of repeat runs as
+    seconds and rows per second.  Returns a dict of rows per second keyed by
+    ledger size.
+    """
+    now = dt.now()
+    results = {}
+    for rows in sizes:
+        df = synthetic_contracts(rows)
+        timings = []
+        for _ in range(repeat):
+            frame = df.copy()
+            started = time.perf_counter()
+            calculations.run_spending_formulas(
+                calculations.run_duration_formulas(frame, now=now))
+            timings.append(time.perf_counter() - started)
+        results[rows] = rows / min(timings)
+        print('{:>9,} contracts: {:8.3f} s  {:>12,.0f} rows/sec'.format(
+            rows, min(timings), results[rows]))
+    return results
+
+def benchmark_fiscal_year(rows=500000, bad_fraction=.05, repeat=3):
+    """
+    Function times fetcher.fiscal_year() on a synthetic ledger shaped like the
+    raw sheet, with bad_fraction of the start and end dates replaced by blanks
+    and text as found in the workbook.  Prints and returns the best time in
+    seconds.
+    """
+    rng = np.random.RandomState(1)
+    df = synthetic_contracts(rows)
+    index = np.array(df.index.astype(object))
+    end = np.array(df['mb_end'].astype(object))
+    for values, junk in ((index, pd.NaT), (end, 'TBD')):
+        values[rng.uniform(size=rows) < bad_fraction / 2] = junk
+    df.index = pd.Index(index, name='MB START')
+    df['mb_end'] = end
+
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        started = time.perf_counter()
+        fetcher.fiscal_year(frame)
+        timings.append(time.perf_counter() - started)
+    print('fiscal_year on {:,} rows with {:.0%} bad dates: {:.3f} s'.format(
+        rows, bad_fraction, min(timings)))
+    return min(timings)
+
+def benchmark_writers(rows=50000, engines=('openpyxl', 'xlsxwriter')):
+    """
+    Function writes one division watchlist workbook of rows flagged contracts
+    with each excel writer backend and prints the time and, from a second
+    traced run, the peak python memory allocated while writing (tracemalloc).  Returns a dict of
+    (seconds, peak bytes) keyed by engine.
+    """
+    contracts = calculations.get_management_dataframe(synthetic_contracts(rows))
+    sheets = {'high burn rate': contracts}
+    results = {}
+    folder = tempfile.mkdtemp()
+    for engine in engines:
+        filename = os.path.join(folder, '{}.xlsx'.format(engine))
+        started = time.perf_counter()
+        contract_parser.write_watchlist_workbook(filename, sheets, engine=engine)
+        elapsed = time.perf_counter() - started
+        # second, traced run for memory as tracing slows the writers down
+        tracemalloc.start()
+        contract_parser.write_watchlist_workbook(filename, sheets, engine=engine)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        os.remove(filename)
+        results[engine] = (elapsed, peak)
+        print('{:>10} writer, {:,} rows: {:8.3f} s  peak {:8.1f} MB'.format(
+            engine, rows, elapsed, peak / 1024 ** 2))
+    os.rmdir(folder)
+    return results
+
+def benchmark_delivery(messages=40, latency=.25, concurrency=(1, 5, 10), port=8025):
+    """
+    Function delivers messages small emails to a local SMTP server that waits
+    latency seconds before accepting each one, at each concurrency level, and
+    prints the time taken and messages per second.  Returns a dict of seconds
+    keyed by concurrency.
+    """
+    handler = transport.SinkHandler(latency=latency)
+    server = transport.local_smtp_server(port=port, handler=handler)
+    mail = transport.SMTPTransport('localhost', port, starttls=False)
+    results = {}
+    try:
+        for workers in concurrency:
+            outbox = []
+            for i in range(messages):
+                msg = MIMEText('benchmark message {}'.format(i))
+                msg['From'], msg['To'] = 'sender@example.org', 'division@example.org'
+                msg['Subject'] = 'Contract Management Watchlist {}'.format(i)
+                outbox.append(('division {}'.format(i), msg, []))
+            started = time.perf_counter()
+            sent = delivery.deliver(outbox, mail, concurrency=workers)
+            results[workers] = time.perf_counter() - started
+            print('{:>3} concurrent, {} messages at {:.2f} s latency: {:8.3f} s  '
+                  '{:6.1f} msg/sec  {} failed'.format(
+                      workers, messages, latency, results[workers],
+                      messages / results[workers], sum(not r.sent for r in sent)))
+    finally:
+        mail.close()
+        server.stop()
+    return results
+
+def benchmark_message_memory(attachment_mb=20, files=4):
+    """
+    Function encodes an email with files attachments of attachment_mb
+    megabytes each, once built in memory with the email package and once
+    streamed with transport.StreamingMessage, and prints the peak python
+    memory allocated by each (tracemalloc).  Returns a dict of peak bytes
+    keyed by method.
+    """
+    folder = tempfile.mkdtemp()
+    paths = []
+    for i in range(files):
+        paths.append(os.path.join(folder, 'memo-{}.pdf'.format(i)))
+        with open(paths[-1], 'wb') as f:
+            f.write(os.urandom(attachment_mb * 1024 ** 2))
+
+    def in_memory():
+        msg = MIMEMultipart()
+        msg.attach(MIMEText('benchmark message'))
+        for path in paths:
+            with open(path, 'rb') as f:
+                payload = MIMEBase('application', 'octet-stream')
+                payload.set_payload(f.read())
+            encoders.encode_base64(payload)
+            msg.attach(payload)
+        return len(msg.as_bytes())
+
+    def streamed():
+        msg = transport.StreamingMessage('sender@example.org', 'division@example.org',
+                                         'Change Order Memos', 'benchmark message', paths)
+        return sum(len(line) for line in msg.iter_lines())
+
+    results = {}
+    for name, encode in (('in memory', in_memory), ('streamed', streamed)):
+        tracemalloc.start()
+        size = encode()
+        results[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{:>9} message of {:.1f} MB: peak {:8.1f} MB'.format(
+            name, size / 1024 ** 2, results[name] / 1024 ** 2))
+    for path in paths:
+        os.remove(path)
+    os.rmdir(folder)
+    return results
+
+def benchmark_schema(rows=1000000):
+    """
+    Function computes the management formulas on a synthetic ledger of rows
+    contracts and prints fetcher.memory_report() for the frame before and
+    after the compact dtypes of fetcher.SCHEMA and
+    calculations.FORMULA_SCHEMA are applied.  Returns the report.
+    """
+    plain = calculations.get_management_dataframe(synthetic_contracts(rows))
+    compact = fetcher.apply_schema(fetcher.apply_schema(plain.copy()),
+                                   calculations.FORMULA_SCHEMA)
+    report = fetcher.memory_report(plain, compact)
+    print(report.to_string())
+    print('{:,} contracts: {:.1f} MB --> {:.1f} MB'.format(
+        rows, report.loc['total', 'bytes before'] / 1024 ** 2,
+        report.loc['total', 'bytes after'] / 1024 ** 2))
+    return report
+
+def benchmark_forecast(rows=100000, scenarios=100):
+    """
+    Function computes the management formulas on a synthetic ledger of rows
+    contracts and times forecast.forecast() over scenarios burn multipliers
+    from forecast.scenario_grid(), printing the seconds and contract
+    scenarios per second.  Returns the seconds.
+    """
+    contracts = calculations.get_management_dataframe(synthetic_contracts(rows))
+    grid = forecast.scenario_grid(count=scenarios, start=3)
+    started = time.perf_counter()
+    result = forecast.forecast(contracts, grid)
+    seconds = time.perf_counter() - started
+    print('{:,} contracts x {} scenarios x {} months: {:.3f} s  {:,.0f} contract '
+          'scenarios/sec'.format(rows, scenarios, contracts['months_left'].max(), seconds,
+                                 rows * scenarios / seconds))
+    return seconds
+
+def benchmark_history(rows=100000, runs=3):
+    """
+    Function appends runs daily snapshots of a synthetic ledger of rows
+    contracts to a history.SnapshotStore in a temporary folder and prints
+    the seconds of each append, which should stay flat as the history
+    grows.  Returns the list of seconds.
+    """
+    contracts = calculations.get_management_dataframe(synthetic_contracts(rows))
+    contracts['fiscal_year'] = np.where(contracts.index.month >= 7,
+                                        contracts.index.year + 1, contracts.index.year)
+    folder = tempfile.mkdtemp()
+    timings = []
+    try:
+        store = history.SnapshotStore(folder)
+        for day in range(runs):
+            started = time.perf_counter()
+            store.append(contracts, now=dt.now() + pd.Timedelta(days=day))
+            timings.append(time.perf_counter() - started)
+            print('{:,} contracts, snapshot {}: {:.3f} s'.format(rows, day + 1, timings[-1]))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return timings
+
+def _measure(function, memory=True):
+    """
+    Call function and return its result, the seconds it took and, from a
+    second traced call when memory is True, the peak python memory it
+    allocated in bytes (None otherwise).
+    """
+    started = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - started
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+def _version():
+    """
+    Return the git commit of the project folder, None outside a repository.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(sizes=(1000, 10000, 100000), memos=100, memory=True, port=8025,
+              output=None):
+    """
+    Function benchmarks every stage of the pipeline on synthetic Contract
+    List workbooks of each size:
+        read_excel                   --> fetcher.create_contractmgmt_dataframe
+                                         without its cache
+        fiscal_year                  --> fetcher.fiscal_year
+        run_duration_formulas        --> on the active contracts
+        run_spending_formulas
+        generate_watchlist_workbooks
+        generate_pdfs                --> for at most memos high burning
+                                         contracts, as memos render one by one
+        deliver                      --> messenger.deliver_reports to a local
+                                         SMTP sink on port
+
+    Each stage is timed and, when memory is True, run again under tracemalloc
+    for its peak memory.  Results are printed, saved as JSON to output when
+    given, and returned as a dict with the environment and, for each size,
+    the seconds, rows per second and peak bytes of every stage.
+    """
+    config = configparser.ConfigParser()
+    config['Email'] = {'email_address': 'benchmark@example.org', 'password': ''}
+    config['SMTP'] = {'host': 'localhost', 'port': str(port), 'starttls': 'no',
+                      'login': 'no'}
+    server = transport.local_smtp_server(port=port, handler=transport.SinkHandler())
+    folder = tempfile.mkdtemp()
+    results = OrderedDict([('version', _version()),
+                           ('created', dt.now().isoformat(timespec='seconds')),
+                           ('python', platform.python_version()),
+                           ('pandas', pd.__version__), ('numpy', np.__version__),
+                           ('sizes', OrderedDict())])
+    try:
+        for rows in sizes:
+            workbook = write_synthetic_workbook(
+                os.path.join(folder, 'Contract List {}.xlsx'.format(rows)), rows)
+            out = os.path.join(folder, str(rows))
+            stages = OrderedDict()
+
+            def stage(name, function):
+                result, seconds, peak = _measure(function, memory)
+                stages[name] = OrderedDict([('seconds', seconds),
+                                            ('rows_per_sec', rows / seconds if seconds else None),
+                                            ('peak_bytes', peak)])
+                print('{:>9,} rows {:<30}{:9.3f} s{}'.format(
+                    rows, name, seconds,
+                    '' if peak is None else '  peak {:8.1f} MB'.format(peak / 1024 ** 2)))
+                return result
+
+            raw = stage('read_excel', lambda: fetcher.create_contractmgmt_dataframe(
+                workbook, cache=False))
+            dated = stage('fiscal_year', lambda: fetcher.fiscal_year(
+                fetcher.format_column_names(raw.copy())))
+            active = dated[dated['mb_end'] > dt.now()]
+            duration = stage('run_duration_formulas', lambda: calculations.run_duration_formulas(
+                active.copy()))
+            contracts = stage('run_spending_formulas', lambda: calculations.run_spending_formulas(
+                duration.copy()))
+            workbooks = stage('generate_watchlist_workbooks',
+                              lambda: contract_parser.generate_watchlist_workbooks(
+                                  contracts=contracts, folder=os.path.join(out, 'workbooks')))
+            flagged = contracts[contracts['burn_status'] == 'high'].head(memos)
+            pdfs = stage('generate_pdfs', lambda: contract_parser.generate_pdfs(
+                contracts=flagged, folder=os.path.join(out, 'memos')))
+            stage('deliver', lambda: messenger.deliver_reports(workbooks, pdfs, config=config))
+            results['sizes'][str(rows)] = stages
+    finally:
+        server.stop()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('results saved to {}'.format(output))
+    return results
+
+def compare_results(baseline, current, tolerance=.2):
+    """
+    Function compares two run_suite() results, dicts or JSON filenames, and
+    prints every stage of every size found in both that took more than
+    tolerance (default 20%) longer, or used that much more memory, in current.
+    Returns a list of (size, stage, measure, baseline, current) regressions.
+    """
+    runs = []
+    for run in (baseline, current):
+        if isinstance(run, str):
+            with open(run) as f:
+                run = json.load(f)
+        runs.append(run)
+    baseline, current = runs
+
+    regressions = []
+    for size, stages in current['sizes'].items():
+        for name, measures in stages.items():
+            before = baseline['sizes'].get(size, {}).get(name)
+            if before is None:
+                continue
+            for measure in ('seconds', 'peak_bytes'):
+                if before.get(measure) and measures.get(measure) and \
+                        measures[measure] > before[measure] * (1 + tolerance):
+                    regressions.append((size, name, measure, before[measure], measures[measure]))
+                    print('regression: {} rows {} {} {:.4g} --> {:.4g}'.format(
+                        size, name, measure, before[measure], measures[measure]))
+    if not regressions:
+        print('no regressions beyond {:.0%}'.format(tolerance))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the contract management program.')
+    parser.add_argument('--suite', action='store_true',
+                        help='benchmark every pipeline stage instead of the single stage benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='contracts in each synthetic workbook (default: %(default)s)')
+    parser.add_argument('--memos', type=int, default=100,
+                        help='most change order memos rendered per size (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the traced runs measuring peak memory')
+    parser.add_argument('--output', help='save the suite results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier suite run to compare with')
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite(args.sizes, memos=args.memos, memory=not args.no_memory,
+                            output=args.output)
+        if args.baseline:
+            compare_results(args.baseline, results)
+    else:
+        benchmark_formulas()
+        benchmark_fiscal_year()
+        benchmark_writers()
+        benchmark_delivery()
+        benchmark_message_memory()
+        benchmark_schema()
+        benchmark_forecast()
+        benchmark_history()
@@ -10,28 +10,113 @@ from datetime import datetime as dt
 # custom module for preparing and returning relevant DGS dataframes
 import fetcher
 
+DEFAULT_WORKBOOK = 'data/Contract List.xlsx'
+
+# numpy's calendar month unit ('M') as a fixed duration: 365.2425 / 12 days
+AVERAGE_MONTH = np.timedelta64(2629746, 's')
+# cap on month offsets so float estimates convert safely to integers
+MAX_MONTHS = 12 * 10000
+
+# columns added to the contracts by get_management_dataframe()
+FORMULA_COLUMNS = ['duration_months', 'months_left', 'months_passed', 'pct_spent',
+                   'desired_burn_rate', 'burn_rate', 'burn_status',
+                   'projected_limit_date', 'watch_list_75%_spent']
+# compact dtypes for the formula columns, applied with fetcher.apply_schema().
+# Percentages and rates are reported, never summed, so float32 is plenty.
+FORMULA_SCHEMA = {'duration_months': 'int16', 'months_left': 'int16',
+                  'months_passed': 'int16', 'pct_spent': 'float32',
+                  'desired_burn_rate': 'float32', 'burn_rate': 'float32',
+                  'burn_status': pd.CategoricalDtype(['low', 'medium', 'high']),
+                  'watch_list_75%_spent': pd.CategoricalDtype(['safe', 'watch'])}
+
+def months_between(start, end):
+    """
+    Function takes two arrays of datetimes and returns the elapsed time from
+    start to end as a float array of average calendar months.  It is the array
+    equivalent of (end - start) / np.timedelta64(1,'M').
+    """
+    start = np.asarray(start, dtype='datetime64[ns]')
+    end = np.asarray(end, dtype='datetime64[ns]')
+    return (end - start) / AVERAGE_MONTH.astype('timedelta64[ns]')
+
+def add_months(dates, months):
+    """
+    Function takes an array of datetimes and an array of whole months and
+    returns the dates shifted forward by those months as a datetime64 array.
+    It follows pd.DateOffset(months=n) semantics for the whole array at once:
+    the day of month is kept and clipped to the last day of shorter months
+    (Jan 31 + 1 month --> Feb 28) and the time of day is preserved.  Dates
+    pushed outside the range of pandas timestamps are returned as NaT.
+    """
+    dates = np.asarray(dates)
+    if dates.dtype.kind != 'M':
+        dates = dates.astype('datetime64[ns]')
+    unit = np.datetime_data(dates.dtype)[0]
+    months = np.asarray(months, dtype='int64')
+    month_start = dates.astype('datetime64[M]')
+    target = month_start + months.astype('timedelta64[M]')
+    month_length = ((target + np.timedelta64(1, 'M')).astype('datetime64[D]') -
+                    target.astype('datetime64[D]'))
+    offset = dates - month_start.astype(dates.dtype)
+    day = offset.astype('timedelta64[D]')
+    time_of_day = offset - day.astype(offset.dtype)
+    day = np.minimum(day, month_length - np.timedelta64(1, 'D'))
+    shifted = target.astype(dates.dtype) + day.astype(offset.dtype) + time_of_day
+
+    # keep a month clear of the limits of nanosecond timestamps so results
+    # stay valid pandas timestamps (and excel dates) whatever the resolution
+    first = np.datetime64(np.iinfo(np.int64).min + 1, 'ns').astype('datetime64[M]')
+    last = np.datetime64(np.iinfo(np.int64).max, 'ns').astype('datetime64[M]')
+    in_bounds = (target > first) & (target < last - np.timedelta64(1, 'M'))
+    return np.where(in_bounds, shifted, np.datetime64('NaT', unit))
+
 # Perform the calculations required for contract management tracking
-def run_duration_formulas(df):
+def run_duration_formulas(df, now=None):
     """
+    Function adds the duration based indicators to a dataframe indexed to the
+    master blanket start date: contract duration in months, months left before
+    the 'mb_end' date and months passed since the contract started.  Each
+    column is computed as a single array operation over the whole frame.  The
+    optional now argument fixes the evaluation date and defaults to dt.now().
     """
-    df['duration_months'] = round((df['mb_end'] - df.index) / np.timedelta64(1,'M')).astype(int)
-    df['months_left'] = [np.ceil(mos).astype(int)
-                     for mos in (df['mb_end'] - dt.now()) / np.timedelta64(1,'M')]
+    now = np.datetime64(dt.now() if now is None else now, 'ns')
+    start = df.index.values
+    end = df['mb_end'].values
+
+    df['duration_months'] = np.round(months_between(start, end)).astype(int)
+    df['months_left'] = np.ceil(months_between(now, end)).astype(int)
 
     # calculate months passed on contract by taking the floor if above 1/2 month
     # passed and returning 1 month if not to be proactive and catch potential early
     # burner contracts that have extreme spending in initial months
-    df['months_passed'] = [np.floor(mos).astype(int) if np.floor(mos) >= 1
-                           else np.floor(mos).astype(int) + 1
-                           for mos in  ((dt.now() - df.index) / np.timedelta64(1,'M'))]
+    months_passed = np.floor(months_between(start, now)).astype(int)
+    df['months_passed'] = np.where(months_passed >= 1, months_passed,
+                                   months_passed + 1)
     return df
 
 def run_spending_formulas(df):
     """
+    Function adds the spending based indicators to a dataframe returned by
+    run_duration_formulas(): percent of limit spent, desired and current burn
+    rate, burn rate status, the projected date the spending limit is reached
+    and the 75% spent watch list flag.  Each column is computed as a single
+    array operation over the whole frame.
+
+    Contracts with no spending yet have an infinite (or undefined) number of
+    months before the limit is reached; their estimate is set to 0 months so
+    the projected limit date falls back to the contract start date.  Estimates
+    too far out for a pandas timestamp get a NaT projected limit date.
     """
-    estimated_months_before_limit_reached = [0 if np.isinf(np.floor(mos)) else
-                                             np.floor(mos).astype(int)
-                                             for mos in  df['mb_$_limit'] /(df['mb_$_spent']/df['months_passed'])]
+    limit = df['mb_$_limit'].values.astype(float)
+    spent = df['mb_$_spent'].values.astype(float)
+    months_passed = df['months_passed'].values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estimated_months_before_limit_reached = np.floor(limit / (spent / months_passed))
+    estimated_months_before_limit_reached = np.where(
+        np.isfinite(estimated_months_before_limit_reached),
+        np.clip(estimated_months_before_limit_reached, -MAX_MONTHS, MAX_MONTHS),
+        0).astype(int)
 
     df['pct_spent'] = (df['mb_$_spent'] / df['mb_$_limit']) * 100
     df['desired_burn_rate'] = ((df['mb_$_limit'] / df['duration_months']) / df['mb_$_limit']) * 100
@@ -39,16 +124,13 @@ def run_spending_formulas(df):
     df['burn_status'] = np.where(df['burn_rate'] >= df['desired_burn_rate'],'high',
                         np.where(df['burn_rate'] <= df['desired_burn_rate']/3,'low','medium'))
 
-    projected_limit_date = []
-    for start,months in zip(df.index,estimated_months_before_limit_reached):
-        projected_limit_date.append(start + pd.DateOffset(months=months))
-
-    df['projected_limit_date'] = projected_limit_date
+    df['projected_limit_date'] = add_months(df.index.values,
+                                            estimated_months_before_limit_reached)
     df['watch_list_75%_spent'] = np.where(df['pct_spent'] >=75,'watch','safe')
 
     return df
 
-def get_management_dataframe():
+def get_management_dataframe(df):
     """
     Function returns complete dataframe with contract management formulas
     run for both relevant measures of duration and spending levels. It
@@ -64,10 +146,98 @@ def get_management_dataframe():
     """
     return run_spending_formulas(run_duration_formulas(df))
 
-# Get and prepare the necessary data
-df = fetcher.create_contractmgmt_dataframe('data/Contract List.xlsx')
-df = fetcher.fiscal_year(df)
-df = fetcher.format_column_names(df)
-# filter dataframe for active contracts
-df = df[df['mb_end'] > dt.now()]
-contracts = get_management_dataframe()
+class ContractBook(object):
+    """
+    Lazily loaded contract management workbook.
+    -------------------------------------------
+    Nothing is read when the object is created.  Each stage of the pipeline is
+    built from the stage before it on first access and memoized, so the
+    workbook is parsed at most once per ContractBook and several workbooks can
+    be evaluated side by side in one process.
+
+    stages:
+        raw       --> master sheet as read from the workbook (or its cache,
+                      pass refresh_cache=True to parse the workbook again).
+                      With streaming=True only the active contracts and the
+                      columns in fetcher.STREAM_COLUMNS are read.
+        cleaned   --> raw with formatted column names and the compact
+                      dtypes of fetcher.SCHEMA
+        fiscal    --> cleaned with a fiscal_year column, undated rows dropped
+        computed  --> active contracts with the management formulas run,
+                      stored in the dtypes of FORMULA_SCHEMA
+
+        example:
+            book = ContractBook('data/Contract List.xlsx')
+            book.computed[book.computed['burn_status'] == 'high']
+    """
+    def __init__(self, filepath=DEFAULT_WORKBOOK, sheet='master', idx_col='MB START',
+                 refresh_cache=False, streaming=False):
+        self.filepath = filepath
+        self.sheet = sheet
+        self.idx_col = idx_col
+        self.refresh_cache = refresh_cache
+        self.streaming = streaming
+        self._stages = {}
+
+    def _stage(self, name, build):
+        """
+        Return the memoized stage called name, building it on first access.
+        """
+        if name not in self._stages:
+            self._stages[name] = build()
+        return self._stages[name]
+
+    @property
+    def raw(self):
+        if self.streaming:
+            return self._stage('raw', lambda: fetcher.read_active_contracts(
+                self.filepath, sheet=self.sheet, idx_col=self.idx_col))
+        return self._stage('raw', lambda: fetcher.create_contractmgmt_dataframe(
+            self.filepath, sheet=self.sheet, idx_col=self.idx_col,
+            refresh=self.refresh_cache))
+
+    @property
+    def cleaned(self):
+        return self._stage('cleaned', lambda: fetcher.apply_schema(
+            fetcher.format_column_names(self.raw.copy())))
+
+    @property
+    def fiscal(self):
+        return self._stage('fiscal', lambda: fetcher.fiscal_year(
+            self.cleaned.copy()))
+
+    @property
+    def computed(self):
+        # filter dataframe for active contracts
+        return self._stage('computed', lambda: fetcher.apply_schema(
+            get_management_dataframe(self.fiscal[self.fiscal['mb_end'] > dt.now()].copy()),
+            FORMULA_SCHEMA))
+
+    def memory_report(self):
+        """
+        Return fetcher.memory_report() comparing the computed contracts in
+        the dtypes guessed when the workbook is read with the computed stage
+        in its compact dtypes.
+        """
+        plain, discarded = fetcher.clean_dates(fetcher.format_column_names(self.raw.copy()))
+        plain = get_management_dataframe(plain[plain['mb_end'] > dt.now()].copy())
+        return fetcher.memory_report(plain, self.computed[plain.columns])
+
+    def reset(self):
+        """
+        Discard every memoized stage so the workbook is read again on the
+        next access.
+        """
+        self._stages.clear()
+
+# workbook evaluated by the program unless another ContractBook is passed in
+default_book = ContractBook()
+
+def __getattr__(name):
+    """
+    Keep calculations.contracts available for existing callers without
+    reading the workbook at import time.
+    """
+    if name == 'contracts':
+        return default_book.computed
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -17,14 +17,74 @@ po_number-changeorder-Month-Day-Year.pdf   for example:
     >> P12246-changeorder-09-12-18.pdf
 """
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime as dt
+from functools import partial
 from fpdf import FPDF
+import numpy as np
 import os
 import pandas as pd
+try:
+    import xlsxwriter
+except ImportError: # workbooks fall back to the openpyxl writer
+    xlsxwriter = None
 # custom module for running DGS contract management formulas
-from calculations import contracts
+import calculations
+
+# watchlist sheets in workbook order: sheet name --> condition on contracts.
+# Each condition is evaluated once over the whole frame by
+# partition_watchlists(), so adding a sheet here adds no extra scans.
+WATCHLISTS = OrderedDict([
+    ('high burn rate', lambda df: df['burn_status'] == 'high'),
+    ('expire 90 days', lambda df: df['months_left'] <= 3),
+    ('expire 180 days', lambda df: df['months_left'] <= 6),
+])
+# watchlists on the trend columns added by history.SnapshotStore.append():
+# contracts burning faster than their desired rate over the last 30 days
+# that the lifetime burn_rate does not flag yet, and contracts whose 30 day
+# burn is a quarter above their 90 day burn
+TREND_WATCHLISTS = OrderedDict([
+    ('recent burn high', lambda df: (df['velocity_30d'] >= df['desired_burn_rate']) &
+                                    (df['burn_status'] != 'high')),
+    ('burn accelerating', lambda df: (df['velocity_90d'] > 0) &
+                                     (df['velocity_30d'] >= df['velocity_90d'] * 1.25)),
+])
+ALL_WATCHLISTS = OrderedDict(list(WATCHLISTS.items()) + list(TREND_WATCHLISTS.items()))
+
+def partition_watchlists(contracts, watchlists=WATCHLISTS):
+    """
+    Function evaluates every watchlist condition over the contracts dataframe
+    in one vectorized pass, groups the contracts by division once and returns
+    an ordered dict of division --> ordered dict of sheet name --> contracts
+    on that watchlist.  Divisions appear in the order they occur in the frame
+    and watchlists without contracts are left out, so a division with no
+    flagged contracts maps to an empty dict.
+    """
+    masks = OrderedDict((name, np.asarray(condition(contracts), dtype=bool))
+                        for name, condition in watchlists.items())
+    positions = contracts.groupby('division', sort=False).indices
+
+    partitions = OrderedDict()
+    for div in contracts['division'].unique():
+        rows = positions.get(div, np.array([], dtype=int))
+        division_contracts = contracts.iloc[rows]
+        partitions[div] = OrderedDict()
+        for name, mask in masks.items():
+            flagged = mask[rows]
+            if flagged.any():
+                partitions[div][name] = division_contracts[flagged]
+    return partitions
+
+def watchlist_filename(division, folder='temporary_workbooks_folder'):
+    """
+    Return the path of a division's watchlist workbook for today's run.
+    """
+    return os.path.join(folder, '{}-blankets-{}.xlsx'.format(
+        '{}'.format(division).lower(), dt.today().strftime('%m-%d-%y')))
 
-def generate_watchlist_workbooks():
+def generate_watchlist_workbooks(contracts=None, workers=None, engine=None, partitions=None,
+                                 folder='temporary_workbooks_folder'):
     """
     Function creates a folder labeled 'temporary_workbooks_folder' and saves
     excel workbooks for each division using contracts. Each workbook contains
@@ -43,55 +103,240 @@ def generate_watchlist_workbooks():
 
     Function returns a list of the filenames created enabling the function call
     to be used to open, attach or access the files generated for each division.
+
+    The contracts dataframe defaults to the computed stage of
+    calculations.default_book; pass another ContractBook's computed frame to
+    report on a different workbook.
+
+    Pass workers=N to write the division workbooks in a pool of N processes.
+    A division whose workbook fails to save is reported and left out of the
+    returned list without stopping the other divisions.  engine selects
+    the excel writer backend, see write_watchlist_workbook().  Pass the
+    result of partition_watchlists() as partitions to reuse it instead of
+    partitioning the contracts again.  folder replaces the default
+    'temporary_workbooks_folder', for example to keep agencies apart.
     """
-    # generate excel files & writers dynamically based on divisions using contracts
-    excel_writers = {}
-    filenames = []
-    for div in contracts['division'].unique():
-        key = '{}'.format(div)
-
-        # create temp directory for holding program generated files in order
-        # to delete sent files and catch and retain files for emails that
-        # failed to send in messenger.py
-        filepath = 'temporary_workbooks_folder'
-        if not os.path.exists(filepath):
-            os.makedirs(filepath)
-
-        filenames.append(os.path.join(filepath,
-                                     '{}-blankets-{}.xlsx'.format(key.lower(),dt.today().strftime('%m-%d-%y'))))
-
-        excel_writers[key] = pd.ExcelWriter(os.path.join(filepath,'{}-blankets-{}.xlsx'.format(key.lower(),dt.today().strftime('%m-%d-%y'))))
-
-        if len(contracts[(contracts['division']==div)&(contracts['burn_status']=='high')]) < 1:
-            pass
-        else:
-            contracts[(contracts['division']==div)&\
-                      (contracts['burn_status']=='high')].to_excel(excel_writers[div],'high burn rate')
-
-        # parse contracts dataframe based on 3 month and 6 month expirations
-        for trigger in [3,6]:
-            if trigger == 3:
-                if len(contracts[(contracts['months_left']<=trigger)&(contracts['division']==div)]) < 1:
-                    pass
-                else:
-                    contracts[(contracts['months_left']<=trigger)&\
-                              (contracts['division']==div)].to_excel(excel_writers[div],'expire 90 days')
+    if partitions is None:
+        if contracts is None:
+            contracts = calculations.default_book.computed
+        partitions = partition_watchlists(contracts)
 
-            else:
-                if len(contracts[(contracts['months_left']<=trigger)&(contracts['division']==div)]) < 1:
-                    pass
-                else:
-                    contracts[(contracts['months_left']<=trigger)&\
-                              (contracts['division']==div)].to_excel(excel_writers[div],'expire 180 days')
+    # create temp directory for holding program generated files in order
+    # to delete sent files and catch and retain files for emails that
+    # failed to send in messenger.py
+    filepath = folder
+    os.makedirs(filepath, exist_ok=True)
+
+    jobs = OrderedDict((div, (watchlist_filename(div, filepath), sheets, engine))
+                       for div, sheets in partitions.items())
 
-        excel_writers[div].save()
+    filenames = []
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = OrderedDict((div, pool.submit(write_watchlist_workbook, *job))
+                                  for div, job in jobs.items())
+            for div, future in futures.items():
+                try:
+                    filenames.append(future.result())
+                except Exception as e:
+                    print('***{} workbook failed: {}***'.format(div, e))
+    else:
+        for div, job in jobs.items():
+            try:
+                filenames.append(write_watchlist_workbook(*job))
+            except Exception as e:
+                print('***{} workbook failed: {}***'.format(div, e))
 
     return filenames
 
+def write_watchlist_workbook(filename, sheets, engine=None):
+    """
+    Save an excel workbook with one sheet per watchlist in sheets, an ordered
+    dict of sheet name --> dataframe as returned by partition_watchlists().
+
+    engine picks the writer backend from WORKBOOK_WRITERS.  It defaults to
+    'xlsxwriter', which streams rows to disk in constant memory mode, and
+    falls back to pandas' 'openpyxl' writer when xlsxwriter is not installed.
+    """
+    if engine is None:
+        engine = 'openpyxl' if xlsxwriter is None else 'xlsxwriter'
+    WORKBOOK_WRITERS[engine](filename, OrderedDict(
+        (name, _excel_floats(df)) for name, df in sheets.items()))
+    return filename
+
+def _excel_floats(df):
+    """
+    Return df with float32 columns widened to float64 and rounded to the 7
+    significant digits float32 holds, so excel shows 112.3761 rather than
+    112.3761138916016.  The rounding is a few array operations per sheet.
+    """
+    narrow = [col for col in df.columns if df[col].dtype == np.float32]
+    if not narrow:
+        return df
+    df = df.copy()
+    values = df[narrow].values.astype(np.float64)
+    rounded = np.isfinite(values) & (values != 0)
+    digits = np.zeros(values.shape, dtype=int)
+    digits[rounded] = 6 - np.floor(np.log10(np.abs(values[rounded]))).astype(int)
+    # scale by an exact power of ten in both directions so the results are
+    # the doubles nearest to the rounded decimals
+    scale = 10.0 ** np.abs(digits)
+    values = np.where(digits >= 0, np.round(values * scale) / scale,
+                      np.round(values / scale) * scale)
+    for i, col in enumerate(narrow):
+        df[col] = values[:, i]
+    return df
+
+def _write_openpyxl(filename, sheets):
+    """
+    Write the workbook with pandas and openpyxl, building it in memory.
+    """
+    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name)
+
+def _write_xlsxwriter(filename, sheets, chunksize=5000):
+    """
+    Write the workbook row by row with xlsxwriter in constant memory mode so
+    only the row being written is held by the writer.  The layout matches
+    DataFrame.to_excel(): a bold header row and the index in the first column.
+    """
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True,
+                                              'nan_inf_to_errors': True,
+                                              'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    bold = workbook.add_format({'bold': True})
+    for name, df in sheets.items():
+        worksheet = workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, [df.index.name] + list(df.columns), bold)
+        row = 1
+        for begin in range(0, len(df), chunksize):
+            chunk = df.iloc[begin:begin + chunksize].reset_index()
+            columns = [_excel_values(chunk[col]) for col in chunk.columns]
+            for values in zip(*columns):
+                worksheet.write_row(row, 0, values)
+                row += 1
+    workbook.close()
+
+def _excel_values(column):
+    """
+    Return a column as a list of python values for xlsxwriter: blanks for
+    NaN/NaT and +/-inf as 'inf'/'-inf', as pandas' to_excel() writes them, for
+    example the desired_burn_rate of a contract shorter than half a month.
+    """
+    values = column.astype(object).where(column.notna(), None)
+    if column.dtype.kind == 'f':
+        infinite = np.isinf(column.values)
+        if infinite.any():
+            values = values.where(~infinite, np.where(column.values > 0, 'inf', '-inf'))
+    return values.tolist()
+
+# excel writer backends for write_watchlist_workbook()
+WORKBOOK_WRITERS = {'openpyxl': _write_openpyxl, 'xlsxwriter': _write_xlsxwriter}
+
+# decoded png images shared by every PDF built in this process
+_IMAGE_CACHE = {}
+
+# static memo layout
+RECIPIENT_ADDRESS = ['Office of Procurement','7 East Redwood Sreet, 10th flr',
+                     'Baltimore, MD 21202']
+MEMO_TEMPLATE = """
+We are writing you to request a change order be issued in the amount of ${:,.2f}\
+ to increase funding for \ncontract ________, Master Blanket Purchase Order {}.\
+   This contract has {} months remaining and is \ndue to expire on {}. The total \
+amount of ${:,.2f} is needed to continue to provide services\nthroughout the \
+remainder of the contract life cycle and gaurd against potentially harmful \
+gaps in service.\n\nThe description of the contract and relevant budget \
+account number are below: \nDescription: "{}"\nBudget Account Number: \
+2029-000000-1982-709500-_______ \n\nThis is an increase to the above \
+referenced contract from ${:,.2f} to ${:,.2f}.  If you have any\nquestions \
+whatsoever regarding the above, please contact __________. Thank you in \
+advance for your thorough\nand celeritious response to this request.\n\n\n\n
+cc: {} \n{}\n{}"""
+
 class PDF(FPDF):
     """
     Create pdf memo document with City seal header and page number footer.
     """
+    def __init__(self, *args, **kwargs):
+        FPDF.__init__(self, *args, **kwargs)
+        self.outlines = [] # bookmarks added with bookmark()
+
+    def bookmark(self, txt, level=0, page=None):
+        """
+        Add a bookmark to the document outline.
+        ---------------------------------------
+        the bookmark points at the top of page (default the current page);
+        level 1 bookmarks are nested under the level 0 bookmark before them.
+        """
+        self.outlines.append({'t': txt, 'l': level, 'y': self.h * self.k,
+                              'p': self.page_no() if page is None else page})
+
+    def _putbookmarks(self):
+        """
+        Write the outline objects for the bookmarks after the resources.
+        """
+        nb = len(self.outlines)
+        last, level = {}, 0
+        for i, outline in enumerate(self.outlines):
+            if outline['l'] > 0:
+                parent = last[outline['l'] - 1]
+                outline['parent'] = parent
+                self.outlines[parent]['last'] = i
+                if outline['l'] > level:
+                    self.outlines[parent]['first'] = i
+            else:
+                outline['parent'] = nb
+            if outline['l'] <= level and i > 0:
+                outline['prev'] = last[outline['l']]
+                self.outlines[outline['prev']]['next'] = i
+            last[outline['l']] = i
+            level = outline['l']
+
+        first = self.n + 1
+        for outline in self.outlines:
+            self._newobj()
+            self._out('<</Title ' + self._textstring(outline['t']))
+            for key, label in (('parent', 'Parent'), ('prev', 'Prev'), ('next', 'Next'),
+                               ('first', 'First'), ('last', 'Last')):
+                if key in outline:
+                    self._out('/{} {} 0 R'.format(label, first + outline[key]))
+            # page objects are numbered 3, 5, 7... by _putpages()
+            self._out('/Dest [{} 0 R /XYZ 0 {:.2f} null]'.format(1 + 2 * outline['p'],
+                                                                 outline['y']))
+            self._out('/Count 0>>')
+            self._out('endobj')
+        self._newobj()
+        self.outline_root = self.n
+        top_level = [i for i, outline in enumerate(self.outlines) if outline['l'] == 0]
+        self._out('<</Type /Outlines /First {} 0 R'.format(first + top_level[0]))
+        self._out('/Last {} 0 R>>'.format(first + top_level[-1]))
+        self._out('endobj')
+
+    def _putresources(self):
+        FPDF._putresources(self)
+        if self.outlines:
+            self._putbookmarks()
+
+    def _putcatalog(self):
+        FPDF._putcatalog(self)
+        if self.outlines:
+            self._out('/Outlines {} 0 R'.format(self.outline_root))
+            self._out('/PageMode /UseOutlines')
+
+    def image(self, name, *args, **kwargs):
+        """
+        Place an image on the page.
+        ---------------------------
+        png files are decoded once per process and reused by every PDF
+        instead of being parsed again for each document.
+        """
+        if (name not in self.images and name.lower().endswith('.png') and
+                hasattr(self, '_parsepng')):
+            if name not in _IMAGE_CACHE:
+                _IMAGE_CACHE[name] = self._parsepng(name)
+            self.images[name] = dict(_IMAGE_CACHE[name], i=len(self.images) + 1)
+        return FPDF.image(self, name, *args, **kwargs)
+
     def header(self):
         """
         Create header for pdf page.
@@ -117,8 +362,14 @@ class PDF(FPDF):
         # page number
         self.cell(0, 10, 'page ' + str(self.page_no()) + '/{nb}', 0, 0, 'C')
 
+def memo_filename(po_number, folder='changeorder_memos'):
+    """
+    Return the path of a contract's change order memo for today's run.
+    """
+    return os.path.join(folder,'{}-changeorder-{}.pdf'.format(po_number,dt.today().strftime('%m-%d-%y')))
+
 def memo(recipient,months_remaining,pct_spent,description,amount,
-                limit,po_number,expiration,division=''):
+                limit,po_number,expiration,division='',folder='changeorder_memos'):
     """
     Generate pdf file of change order memo for a contract.
     ------------------------------------------------------
@@ -132,8 +383,9 @@ def memo(recipient,months_remaining,pct_spent,description,amount,
         po_number        --> string
         expiration       --> datetime timestamp object
 
-    optional argument:
+    optional arguments:
         division         --> string
+        folder           --> string   (default 'changeorder_memos')
 
         example function call:
                 memo(recipient='michael b jordan', months_remaining=8,
@@ -144,11 +396,25 @@ def memo(recipient,months_remaining,pct_spent,description,amount,
 
         >>> P1224-changeorder-amount-09-12-18.pdf
     """
-
-    recipient_address = ['Office of Procurement','7 East Redwood Sreet, 10th flr',
-                        'Baltimore, MD 21202']
     pdf = PDF() # instantiate PDF class object
     pdf.alias_nb_pages()
+    memo_page(pdf, recipient, months_remaining, pct_spent, description, amount,
+              limit, po_number, expiration, division)
+    # save to file
+    filepath = folder
+    name = memo_filename(po_number, filepath)
+    os.makedirs(filepath, exist_ok=True)
+    pdf.output(name)
+
+    return name
+
+def memo_page(pdf,recipient,months_remaining,pct_spent,description,amount,
+              limit,po_number,expiration,division=''):
+    """
+    Add a page with the change order memo for a contract to pdf.
+    ------------------------------------------------------------
+    takes the same arguments as memo() after the PDF object.
+    """
     pdf.add_page()
     pdf.set_font(family='Times',style='B',size=16)
     pdf.set_text_color(r=153,g=153,b=0)
@@ -167,23 +433,11 @@ def memo(recipient,months_remaining,pct_spent,description,amount,
     pdf.cell(w=10,h=5,txt=dt.today().strftime('%B %d, %Y'),ln=1)
     pdf.cell(w=10,h=5,txt='',ln=0)
 
-    for ln,text in enumerate(recipient_address):
+    for ln,text in enumerate(RECIPIENT_ADDRESS):
         pdf.cell(100,5,text,ln=ln+.25)
     [pdf.ln() for i in range(2)]
     pdf.multi_cell(600,5,
-                   txt = """
-We are writing you to request a change order be issued in the amount of ${:,.2f}\
- to increase funding for \ncontract ________, Master Blanket Purchase Order {}.\
-   This contract has {} months remaining and is \ndue to expire on {}. The total \
-amount of ${:,.2f} is needed to continue to provide services\nthroughout the \
-remainder of the contract life cycle and gaurd against potentially harmful \
-gaps in service.\n\nThe description of the contract and relevant budget \
-account number are below: \nDescription: "{}"\nBudget Account Number: \
-2029-000000-1982-709500-_______ \n\nThis is an increase to the above \
-referenced contract from ${:,.2f} to ${:,.2f}.  If you have any\nquestions \
-whatsoever regarding the above, please contact __________. Thank you in \
-advance for your thorough\nand celeritious response to this request.\n\n\n\n
-cc: {} \n{}\n{}""".format(
+                   txt = MEMO_TEMPLATE.format(
                         amount, po_number, months_remaining,
                         '{} {}, {}'.format(expiration.strftime('%B'),expiration.day,expiration.year),
                         amount, description, limit, limit+amount,'Berke Attila',
@@ -194,17 +448,108 @@ cc: {} \n{}\n{}""".format(
     pdf.image('images/signature.png',w=50,h=40)
     pdf.ln()
     pdf.cell(10,5,'AP Supervisor')
-    # save to file
-    filepath = 'changeorder_memos'
-    name = os.path.join(filepath,'{}-changeorder-{}.pdf'.format(po_number,dt.today().strftime('%m-%d-%y')))
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
+    return pdf
+
+def generate_combined_memo(rcpnt='marcia diggs',percent_of_limit=10,contracts=None,
+                           index=True,bookmarks=True,folder='changeorder_memos',
+                           amounts=None):
+    """
+    Generate one pdf with the change order memos for every high burning contract
+    ----------------------------------------------------------------------------
+    Memos are rendered as pages of a single document ordered by division and
+    PO number instead of one file per contract.  Saved in changeorder_memos as:
+        changeorder-memos-month-day-year.pdf
+
+    optional arguments:
+        rcpnt, percent_of_limit, contracts, folder,
+        amounts            --> as for generate_pdfs()
+        index              --> bool     (open with a page listing every memo,
+                                         each entry linked to its page)
+        bookmarks          --> bool     (add document bookmarks for each
+                                         division with its memos nested)
+
+    Function returns the filename of the combined pdf.
+    """
+    if contracts is None:
+        contracts = calculations.default_book.computed
+
+    # argument positions: 6 --> po_number, 8 --> division
+    jobs = sorted(memo_arguments(contracts, rcpnt, percent_of_limit, amounts),
+                  key=lambda args: ('{}'.format(args[8]), '{}'.format(args[6])))
+    pdf = PDF()
+    pdf.alias_nb_pages()
+    links = [pdf.add_link() for args in jobs]
+
+    if index:
+        pdf.add_page()
+        pdf.set_font(family='Times',style='B',size=16)
+        pdf.cell(w=0,h=10,txt='Change Order Memos {}'.format(dt.today().strftime('%B %d, %Y')),ln=1)
+        division = None
+        for args, link in zip(jobs, links):
+            if args[8] != division:
+                division = args[8]
+                pdf.set_font(family='Times',style='B',size=12)
+                pdf.cell(w=0,h=8,txt='{}'.format(division),ln=1)
+            pdf.set_font(family='Times',style='',size=10)
+            pdf.cell(w=25,h=5,txt='{}'.format(args[6]),ln=0,link=link)
+            pdf.cell(w=130,h=5,txt='{}'.format(args[3])[:80],ln=0,link=link)
+            pdf.cell(w=0,h=5,txt='${:,.2f}'.format(args[4]),ln=1,align='R',link=link)
+
+    division = None
+    for args, link in zip(jobs, links):
+        page = pdf.page_no() + 1 # memo_page() starts a new page
+        memo_page(pdf, *args)
+        pdf.set_link(link, y=0, page=page)
+        if bookmarks:
+            if args[8] != division:
+                division = args[8]
+                pdf.bookmark('{}'.format(division), level=0, page=page)
+            pdf.bookmark('{}'.format(args[6]), level=1, page=page)
+
+    filepath = folder
+    name = os.path.join(filepath,'changeorder-memos-{}.pdf'.format(dt.today().strftime('%m-%d-%y')))
+    os.makedirs(filepath, exist_ok=True)
     pdf.output(name)
 
+    print('generate_combined_memo function run complete.')
     return name
 
+def _memo_from_args(args, folder='changeorder_memos'):
+    """
+    Unpack a tuple of memo() arguments, for use with a process pool.
+    """
+    return memo(*args, folder=folder)
 
-def generate_pdfs(rcpnt='marcia diggs',percent_of_limit=10):
+def memo_arguments(contracts, rcpnt='marcia diggs', percent_of_limit=10, amounts=None):
+    """
+    Return a list of memo() argument tuples, one per high burning contract,
+    built column-wise from the contracts dataframe.  The amount requested is
+    the blanket limit / percent_of_limit unless amounts, an array of change
+    order amounts in the order of contracts such as returned by
+    forecast.change_order_amounts(), is given; high burning contracts that
+    need no change order are then left out.
+    """
+    high = np.asarray(contracts['burn_status'] == 'high', dtype=bool)
+    if amounts is None:
+        high_df = contracts[high]
+        requested = high_df['mb_$_limit'] / percent_of_limit
+    else:
+        amounts = np.asarray(amounts, dtype=float)
+        high = high & (amounts > 0)
+        high_df = contracts[high]
+        requested = amounts[high]
+    return list(zip([rcpnt] * len(high_df),
+                    high_df['months_left'].tolist(),
+                    high_df['pct_spent'].tolist(),
+                    high_df['description'].tolist(),
+                    requested.tolist(),
+                    high_df['mb_$_limit'].tolist(),
+                    high_df['po'].tolist(),
+                    list(high_df['mb_end']),
+                    high_df['division'].tolist()))
+
+def generate_pdfs(rcpnt='marcia diggs',percent_of_limit=10,contracts=None,workers=None,
+                  folder='changeorder_memos',amounts=None):
     """
     Generate change order memo as pdf for each high burning contract
     -----------------------------------------------------------------
@@ -212,26 +557,35 @@ def generate_pdfs(rcpnt='marcia diggs',percent_of_limit=10):
         rcpnt              --> string   (default value for memo recpient)
         percent_of_limit   --> int      (default vaule for amount of request as
                                          a percentage of the blanket limit)
+        contracts          --> dataframe (defaults to the computed stage of
+                                         calculations.default_book)
+        workers            --> int      (render memos in a pool of this many
+                                         processes)
+        folder             --> string   (folder the memos are saved in,
+                                         default 'changeorder_memos')
+        amounts            --> array    (change order amounts in the order of
+                                         contracts, e.g. from
+                                         forecast.change_order_amounts(),
+                                         instead of percent_of_limit)
 
     """
-    filenames = []
-    high_df = contracts[contracts['burn_status'] == 'high']
-    for index,row in high_df.iterrows():
-        filenames.append(memo(recipient=rcpnt,
-                months_remaining=row['months_left'],
-                pct_spent=row['pct_spent'],
-                description=row['description'],
-                amount=(row['mb_$_limit']/ percent_of_limit),
-                limit=row['mb_$_limit'],
-                po_number=row['po'],
-                expiration=row['mb_end'],
-                division=row['division']))
+    if contracts is None:
+        contracts = calculations.default_book.computed
+
+    jobs = memo_arguments(contracts, rcpnt, percent_of_limit, amounts)
+    # created once here, before the pool's workers save memos into it
+    os.makedirs(folder, exist_ok=True)
+    if workers and workers > 1 and jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            filenames = list(pool.map(partial(_memo_from_args, folder=folder), jobs,
+                                      chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        filenames = [memo(*args, folder=folder) for args in jobs]
 
     print('generate_pdfs function run complete.')
     return filenames
 
 
-
 if __name__ == '__main__':
     generate_watchlist_workbooks()
     generate_pdfs()
@@ -0,0 +1,257 @@
+"""
+Module for keeping the contract ledger in an embedded SQLite database so
+watchlists and ad-hoc questions are answered with indexed queries instead
+of filtering the whole dataframe.
+
+The dated contracts (fetcher.fiscal_year output) are loaded into a
+'contracts' table and the contract management formulas of the
+calculations module are defined as SQL views over it:
+
+    contract_months      --> elapsed months from start to end, now to end
+                             and start to now as fractional average months
+    contract_duration    --> duration_months, months_left, months_passed
+    contract_management  --> the spending indicators: pct_spent,
+                             desired_burn_rate, burn_rate, burn_status,
+                             projected_limit_date, watch_list_75%_spent
+
+Divisions follow numpy: a zero divisor gives +/-inf, and NULL (NaN) for
+0 / 0, so contracts are classified exactly as in the pandas formulas.
+
+refresh() materializes the active rows of contract_management into the
+'management' table, indexed on po, division, mb_end and burn_status.  The
+evaluation date is kept in the store_info table so the views always agree
+with the last refresh.
+
+    example:
+        store = ContractStore('.contract_store.sqlite')
+        store.load(calculations.default_book.fiscal)
+        store.watchlist('high burn rate', division='Fleet')
+        store.query('SELECT division, count(*) FROM management GROUP BY division')
+"""
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime as dt
+
+import pandas as pd
+
+# custom module for running DGS contract management formulas
+import calculations
+# custom module for preparing and returning relevant DGS dataframes
+import fetcher
+
+STORE_DB = '.contract_store.sqlite'
+# calculations.AVERAGE_MONTH in seconds
+MONTH_SECONDS = 2629746
+# calculations.MAX_MONTHS
+MAX_MONTHS = 12 * 10000
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# evaluation date of the management table
+_NOW = "(SELECT value FROM store_info WHERE key = 'now')"
+
+# watchlist sheets as SQL conditions on the management table, matching
+# contract_parser.WATCHLISTS.  months_left <= n holds exactly when mb_end is
+# at most n average months after the evaluation date, written that way so
+# the mb_end index is used.
+WATCHLIST_QUERIES = OrderedDict([
+    ('high burn rate', "burn_status = 'high'"),
+    ('expire 90 days', "mb_end <= datetime({}, '+{} seconds')".format(_NOW, 3 * MONTH_SECONDS)),
+    ('expire 180 days', "mb_end <= datetime({}, '+{} seconds')".format(_NOW, 6 * MONTH_SECONDS)),
+])
+
+def _floor(x):
+    return '(CAST({0} AS INTEGER) - ({0} < CAST({0} AS INTEGER)))'.format(x)
+
+def _ceil(x):
+    return '(CAST({0} AS INTEGER) + ({0} > CAST({0} AS INTEGER)))'.format(x)
+
+def _divide(numerator, denominator):
+    # SQLite returns NULL for any division by zero, numpy returns +/-inf for a
+    # nonzero numerator and NaN (stored as NULL) for 0 / 0
+    return ('(CASE WHEN {1} = 0 THEN CASE WHEN {0} > 0 THEN 9e999 WHEN {0} < 0 THEN -9e999 END '
+            'ELSE {0} * 1.0 / {1} END)').format(numerator, denominator)
+
+def _months(start, end):
+    return '((julianday({}) - julianday({})) * 86400.0 / {})'.format(end, start,
+                                                                    MONTH_SECONDS)
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+class ContractStore(object):
+    """
+    SQLite copy of the contract ledger with the management formulas as views.
+    -------------------------------------------------------------------------
+    path defaults to a temporary in-memory database; pass a filename such as
+    STORE_DB to keep the store between runs.
+    """
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS store_info '
+                                '(key TEXT PRIMARY KEY, value TEXT)')
+
+    def _info(self, key, default=None):
+        row = self.connection.execute('SELECT value FROM store_info WHERE key = ?',
+                                      (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_info(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO store_info VALUES (?, ?)',
+                                (key, value))
+
+    def load(self, contracts, now=None):
+        """
+        Function replaces the stored ledger with the contracts dataframe, a
+        frame indexed to the master blanket start date with formatted column
+        names and valid dates (fetcher.fiscal_year output), rebuilds the
+        views and indexes and refreshes the management table for now
+        (default dt.now()).  Returns the number of contracts loaded.
+        """
+        frame = contracts.reset_index()
+        index_name = frame.columns[0]
+        frame = frame.rename(columns={index_name: 'mb_start'})
+        for col in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[col]):
+                frame[col] = frame[col].dt.strftime(DATE_FORMAT)
+        columns = [col for col in frame.columns if col != 'mb_start']
+
+        with self.connection:
+            for view in ('contract_management', 'contract_duration', 'contract_months'):
+                self.connection.execute('DROP VIEW IF EXISTS {}'.format(view))
+            self.connection.execute('DROP TABLE IF EXISTS management')
+            frame.to_sql('contracts', self.connection, if_exists='replace', index=False)
+            for col in ('po', 'division', 'mb_end'):
+                self.connection.execute('CREATE INDEX contracts_{0} ON contracts ({0})'.format(col))
+            self._set_info('index_name', index_name)
+            self._set_info('columns', '\t'.join(columns))
+            for statement in self._views(columns):
+                self.connection.execute(statement)
+        self.refresh(now)
+        return len(frame)
+
+    def _views(self, columns):
+        """
+        Return the CREATE VIEW statements for the management formulas.
+        """
+        inputs = ', '.join(['c.mb_start'] + ['c.' + _quote(col) for col in columns])
+        passed = _floor('months_passed_exact')
+        limit, spent = '"mb_$_limit"', '"mb_$_spent"'
+        estimate = _floor('({} * 1.0 / ({} * 1.0 / months_passed))'.format(limit, spent))
+        estimate = ('CASE WHEN {0} IS NULL THEN 0 ELSE max(-{1}, min({1}, {0})) END'
+                    .format(estimate, MAX_MONTHS))
+        # add_months semantics: keep the day of month, clipped to month end
+        target = "date(mb_start, 'start of month', months_to_limit || ' months')"
+        # and NULL (NaT) outside the range of pandas timestamps
+        projected = ("CASE WHEN {0} > '1677-09-01' AND {0} < '2262-03-01' THEN "
+                     "min(date({0}, (CAST(strftime('%d', mb_start) AS INTEGER) - 1) || ' days'), "
+                     "date({0}, '+1 month', '-1 day')) || ' ' || time(mb_start) END").format(target)
+        return [
+            'CREATE VIEW contract_months AS SELECT {}, {} AS duration_exact, '
+            '{} AS months_left_exact, {} AS months_passed_exact '
+            'FROM contracts c'.format(inputs, _months('c.mb_start', 'c.mb_end'),
+                                      _months(_NOW, 'c.mb_end'),
+                                      _months('c.mb_start', _NOW)),
+            'CREATE VIEW contract_duration AS SELECT *, '
+            'CAST(round(duration_exact) AS INTEGER) AS duration_months, '
+            '{0} AS months_left, '
+            'CASE WHEN {1} >= 1 THEN {1} ELSE {1} + 1 END AS months_passed '
+            'FROM contract_months'.format(_ceil('months_left_exact'), passed),
+            'CREATE VIEW contract_management AS SELECT {inputs}, duration_months, '
+            'months_left, months_passed, pct_spent, desired_burn_rate, burn_rate, '
+            "CASE WHEN burn_rate >= desired_burn_rate THEN 'high' "
+            "WHEN burn_rate <= desired_burn_rate / 3 THEN 'low' ELSE 'medium' END AS burn_status, "
+            '{projected} AS projected_limit_date, '
+            "CASE WHEN pct_spent >= 75 THEN 'watch' ELSE 'safe' END AS \"watch_list_75%_spent\" "
+            'FROM (SELECT *, '
+            '{pct_spent} * 100 AS pct_spent, '
+            '{desired} * 100 AS desired_burn_rate, '
+            '{burn} * 100 AS burn_rate, '
+            '{estimate} AS months_to_limit FROM contract_duration)'.format(
+                inputs=', '.join(['mb_start'] + [_quote(col) for col in columns]),
+                projected=projected, estimate=estimate,
+                pct_spent=_divide(spent, limit),
+                desired=_divide(_divide(limit, 'duration_months'), limit),
+                burn=_divide(_divide(spent, 'months_passed'), limit)),
+        ]
+
+    def refresh(self, now=None):
+        """
+        Function evaluates the views for now (default dt.now()) and stores
+        the active contracts, those ending after now, in the indexed
+        management table.  Returns the number of active contracts.
+        """
+        now = (dt.now() if now is None else pd.Timestamp(now)).strftime(DATE_FORMAT)
+        with self.connection:
+            self._set_info('now', now)
+            self.connection.execute('DROP TABLE IF EXISTS management')
+            # unary + keeps the mb_end index out of the scan so rows stay in
+            # ledger order
+            self.connection.execute('CREATE TABLE management AS SELECT * FROM '
+                                    'contract_management WHERE +mb_end > ?', (now,))
+            for col in ('po', 'division', 'mb_end', 'burn_status'):
+                self.connection.execute('CREATE INDEX management_{0} ON management ({0})'.format(col))
+        return self.connection.execute('SELECT count(*) FROM management').fetchone()[0]
+
+    def query(self, sql, params=()):
+        """
+        Run a SELECT statement and return the result as a dataframe.  Rows of
+        the contracts or management tables come back indexed to the master
+        blanket start date with their date columns parsed and the columns in
+        the dtypes of fetcher.SCHEMA and calculations.FORMULA_SCHEMA, as in
+        calculations.ContractBook.computed.
+        """
+        df = pd.read_sql_query(sql, self.connection, params=params)
+        for col in ('mb_start', 'mb_end', 'projected_limit_date'):
+            if col in df:
+                df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors='coerce')
+        if 'mb_start' in df:
+            df = df.set_index('mb_start')
+            df.index.name = self._info('index_name', 'MB START')
+        return fetcher.apply_schema(fetcher.apply_schema(df), calculations.FORMULA_SCHEMA)
+
+    def computed(self):
+        """
+        Return the management table as a dataframe shaped like
+        calculations.ContractBook.computed.
+        """
+        return self.query('SELECT * FROM management ORDER BY rowid')
+
+    def watchlist(self, name, division=None):
+        """
+        Return the contracts on the watchlist called name (see
+        WATCHLIST_QUERIES), optionally for one division only.
+        """
+        where = WATCHLIST_QUERIES[name]
+        if division is None:
+            return self.query('SELECT * FROM management WHERE {} ORDER BY rowid'.format(where))
+        return self.query('SELECT * FROM management WHERE division = ? AND {} '
+                          'ORDER BY rowid'.format(where), (division,))
+
+    def partitions(self, watchlists=WATCHLIST_QUERIES):
+        """
+        Function returns the division watchlists in the structure of
+        contract_parser.partition_watchlists(): an ordered dict of division
+        --> ordered dict of sheet name --> contracts, built with one indexed
+        query per division and watchlist.
+        """
+        divisions = [row[0] for row in self.connection.execute(
+            'SELECT division FROM management GROUP BY division ORDER BY min(rowid)')]
+        partitions = OrderedDict()
+        for div in divisions:
+            partitions[div] = OrderedDict()
+            for name, where in watchlists.items():
+                flagged = self.query('SELECT * FROM management WHERE division IS ? AND {} '
+                                     'ORDER BY rowid'.format(where), (div,))
+                if len(flagged):
+                    partitions[div][name] = flagged
+        return partitions
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,70 @@
+"""
+Module for delivering a batch of contract management emails.  Messages
+are sent concurrently by a fixed number of worker threads over the pooled
+transport.SMTPTransport, each send holding its own connection from the
+pool, so the number of open connections never exceeds the concurrency
+limit.  Every message is retried with exponential backoff on its own, so a
+bad address or a dropped connection only affects that message, and a
+DeliveryResult is returned for each message so callers know exactly which
+files went out.
+
+Messages built as transport.StreamingMessage stream their attachments from
+disk while they are sent; any other email.message.Message is sent whole.
+"""
+import smtplib
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# key      --> label for the message, e.g. the division
+# files    --> files attached to the message
+# sent     --> True when the server accepted the message
+# attempts --> number of sends attempted
+# error    --> last exception raised, None when sent
+DeliveryResult = namedtuple('DeliveryResult', 'key files sent attempts error')
+
+def deliver(outbox, mail, concurrency=5, retries=3, backoff=1.0):
+    """
+    Function sends every message in outbox, a list of (key, message, files)
+    tuples, over mail, a transport.SMTPTransport whose pool is grown to hold
+    a connection for every worker.
+
+    At most concurrency messages are in flight at once.  A message that fails
+    is sent again up to retries more times, waiting backoff, 2 * backoff,
+    4 * backoff... seconds between attempts; server rejections with a
+    permanent (5xx) code are not retried.
+
+    Function returns a list of DeliveryResult in the order of outbox.
+    """
+    if not outbox:
+        return []
+    workers = max(1, min(concurrency, len(outbox)))
+    mail.pool_size = max(mail.pool_size, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_deliver_one, key, msg, files, mail, retries, backoff)
+                   for key, msg, files in outbox]
+        return [future.result() for future in futures]
+
+def _deliver_one(key, msg, files, mail, retries, backoff):
+    """
+    Send one message over the transport with the retry policy of deliver().
+    """
+    for attempt in range(1, retries + 2):
+        try:
+            mail.send(msg)
+            return DeliveryResult(key, files, True, attempt, None)
+        except Exception as e: # any failure is confined to this message
+            error = e
+            if _permanent(e) or attempt > retries:
+                break
+            time.sleep(backoff * 2 ** (attempt - 1))
+    return DeliveryResult(key, files, False, attempt, error)
+
+def _permanent(error):
+    """
+    Return True for server rejections that will fail again if retried.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(error, 'smtp_code', None)
+    return isinstance(code, int) and 500 <= code < 600
@@ -1,11 +1,65 @@
 """
 Module for getting, cleaning and returning formatted
-data for the contract management program
+data for the contract management program.
+
+Parsed workbook sheets are kept in an on-disk cache folder as uncompressed
+Feather files (pickle when pyarrow is not installed or a column cannot be
+stored as Arrow) so later runs memory map the data instead of parsing the
+Excel file again.  Entries are keyed on the workbook path, modification
+time, size, sheet and index column and the least recently used entries are
+evicted once the folder grows past its size cap.  Manifest updates hold a
+lock file in the cache folder, so processes sharing the cache, such as the
+batch module's workers, do not overwrite each other's entries.
+
+load_contract_store() loads a sheet into an indexed SQLite store instead of
+a dataframe, see the contract_store module.
 """
+import hashlib
+import json
+import os
+import pickle
+import time
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
+from datetime import datetime as dt
+from openpyxl import load_workbook
+
+import contract_store # indexed SQLite copy of the ledger
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError: # cache falls back to pickle files
+    pa = None
+
+try:
+    import fcntl
+except ImportError: # windows, the manifest is locked with msvcrt
+    fcntl = None
+    import msvcrt
+
+# formatted names of the columns the program uses, read by the streaming reader
+STREAM_COLUMNS = ['po', 'buyer', 'mb_end', 'description', 'vendor', 'mb_$_limit',
+                  'mb_$_spent', 'division', 'options_remaining', 'comments']
+DATE_COLUMNS = ['mb_end']
+NUMERIC_COLUMNS = ['mb_$_limit', 'mb_$_spent']
+
+# compact dtypes for the formatted workbook columns, see apply_schema().
+# Text that repeats across contracts is categorical, free text is stored in
+# arrow backed strings when pyarrow is installed.
+TEXT_DTYPE = 'string' if pa is None else 'string[pyarrow]'
+SCHEMA = {'po': TEXT_DTYPE, 'description': TEXT_DTYPE, 'vendor': TEXT_DTYPE,
+          'comments': TEXT_DTYPE, 'division': 'category', 'buyer': 'category'}
+
+CACHE_DIR = '.contract_cache'
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+_MANIFEST = 'manifest.json'
+_LOCK = 'manifest.lock'
 
-def create_contractmgmt_dataframe(filepath, sheet='master', idx_col='MB START'):
+def create_contractmgmt_dataframe(filepath, sheet='master', idx_col='MB START',
+                                  cache=True, refresh=False, cache_dir=CACHE_DIR):
     """
     Function creates a dataframe indexed to the master blanket start
     date for the contract management excel workbook. It drops all pre-
@@ -13,42 +67,364 @@ def create_contractmgmt_dataframe(filepath, sheet='master', idx_col='MB START'):
     default. Additional columns can be included or excluded by changing the
     cols variable to include or exclude desired columns if they exist in
     the workbook.
+
+    The parsed sheet is served from the cache in cache_dir while the workbook
+    is unchanged.  Pass refresh=True to parse the workbook again and replace
+    the cached copy, or cache=False to bypass the cache entirely.
     """
+    if not cache:
+        return pd.read_excel(filepath, sheet_name=sheet, index_col=idx_col)
+
+    key = _cache_key(filepath, sheet, idx_col)
+    if not refresh:
+        df = _read_cache(cache_dir, key)
+        if df is not None:
+            return df
+
     df = pd.read_excel(filepath, sheet_name=sheet, index_col=idx_col)
+    _write_cache(cache_dir, key, df, source=(os.path.abspath(filepath), sheet, idx_col))
     return df
 
-def fiscal_year(df):
+def load_contract_store(filepath, sheet='master', idx_col='MB START', database=':memory:',
+                        refresh=False, now=None):
+    """
+    Function reads a sheet of the contract management workbook (through the
+    cache, pass refresh=True to parse the workbook again), formats and dates
+    it like the ContractBook pipeline and loads it into a
+    contract_store.ContractStore at database, evaluated for now (default
+    dt.now()).  Returns the store.
+    """
+    df = fiscal_year(format_column_names(create_contractmgmt_dataframe(
+        filepath, sheet=sheet, idx_col=idx_col, refresh=refresh).copy()))
+    store = contract_store.ContractStore(database)
+    store.load(df, now=now)
+    return store
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    Function deletes every cached sheet in cache_dir and returns the number
+    of entries removed.
+    """
+    if not os.path.exists(cache_dir):
+        return 0
+    with _manifest_lock(cache_dir):
+        manifest = _load_manifest(cache_dir)
+        for entry in manifest.values():
+            _remove_quietly(os.path.join(cache_dir, entry['file']))
+        _save_manifest(cache_dir, {})
+    return len(manifest)
+
+def stream_contractmgmt_chunks(filepath, sheet='master', idx_col='MB START',
+                               columns=STREAM_COLUMNS, chunksize=10000, now=None):
+    """
+    Function reads the contract management excel workbook row by row in
+    openpyxl read-only mode and yields typed dataframes of at most chunksize
+    active contracts.  Only the requested columns (formatted names as returned
+    by format_column_names) and the idx_col index are kept, and contracts whose
+    'mb_end' date is not after now (default dt.now()) are skipped as they are
+    read, so memory use follows the active contracts rather than the whole
+    sheet.
+    """
+    now = dt.now() if now is None else now
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet].iter_rows(values_only=True)
+        header = [_column_name(h) if isinstance(h, str) else None for h in next(rows)]
+        idx_pos = header.index(_column_name(idx_col))
+        end_pos = header.index('mb_end')
+        wanted = [(i, name) for i, name in enumerate(header)
+                  if name in columns and i != idx_pos]
+        names = [name for i, name in wanted]
+
+        index, records, chunks = [], [], 0
+        for row in rows:
+            end = row[end_pos] if end_pos < len(row) else None
+            if not isinstance(end, dt) or end <= now:
+                continue
+            index.append(row[idx_pos])
+            records.append([row[i] if i < len(row) else None for i, name in wanted])
+            if len(records) >= chunksize:
+                yield _typed_chunk(records, index, names, idx_col)
+                index, records, chunks = [], [], chunks + 1
+        # a sheet without active contracts still yields one empty typed chunk
+        if records or not chunks:
+            yield _typed_chunk(records, index, names, idx_col)
+    finally:
+        workbook.close()
+
+def read_active_contracts(filepath, sheet='master', idx_col='MB START',
+                          columns=STREAM_COLUMNS, chunksize=10000, now=None):
+    """
+    Function returns a dataframe of the active contracts in the workbook
+    assembled from stream_contractmgmt_chunks().  Column names are already
+    formatted and only the requested columns are included.
+    """
+    return pd.concat(stream_contractmgmt_chunks(filepath, sheet=sheet, idx_col=idx_col,
+                                                columns=columns, chunksize=chunksize,
+                                                now=now))
+
+def _typed_chunk(records, index, names, idx_col):
+    """
+    Build a dataframe from streamed rows with datetime and numeric columns
+    coerced to their dtypes.
+    """
+    df = pd.DataFrame.from_records(records, columns=names)
+    df.index = pd.DatetimeIndex(pd.to_datetime(pd.Series(index, dtype=object),
+                                               errors='coerce'), name=idx_col)
+    for col in DATE_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    for col in NUMERIC_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def _column_name(col):
+    """
+    Return the formatted version of a string column header.
+    """
+    return col.strip().lower().replace(' ','_')
+
+def _cache_key(filepath, sheet, idx_col):
+    """
+    Return the cache key for a sheet of a workbook in its current state.
+    """
+    stat = os.stat(filepath)
+    ident = repr((os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size,
+                  sheet, idx_col))
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+@contextmanager
+def _manifest_lock(cache_dir):
+    """
+    Hold an exclusive lock on the manifest of cache_dir, waiting for other
+    processes to release it, so a read-modify-write of the manifest is not
+    lost to a concurrent one.
+    """
+    with open(os.path.join(cache_dir, _LOCK), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _load_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _save_manifest(cache_dir, manifest):
+    # write then rename so concurrent runs never see a half written manifest
+    path = os.path.join(cache_dir, _MANIFEST)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp, path)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _read_cache(cache_dir, key):
+    """
+    Return the cached dataframe for key, or None on a cache miss.  The lock
+    is only held to look up and touch the manifest entry; data files are
+    replaced atomically and never rewritten in place, so the read itself
+    runs unlocked and parallel readers do not wait on each other.
+    """
+    if not os.path.exists(os.path.join(cache_dir, _MANIFEST)):
+        return None
+    with _manifest_lock(cache_dir):
+        entry = _load_manifest(cache_dir).get(key)
+    if entry is None:
+        return None
+
+    path = os.path.join(cache_dir, entry['file'])
+    try:
+        if entry['format'] == 'feather':
+            # memory mapped and split into per column blocks to avoid copies
+            table = feather.read_table(path, memory_map=True)
+            columns, index_name = pickle.loads(table.schema.metadata[b'labels'])
+            df = table.to_pandas(split_blocks=True).set_index('__index__')
+            df.index.name = index_name
+            df.columns = columns
+        else:
+            with open(path, 'rb') as f:
+                df = pickle.load(f)
+    except Exception: # unreadable or evicted meanwhile, treat as a miss
+        df = None
+
+    with _manifest_lock(cache_dir):
+        manifest = _load_manifest(cache_dir)
+        # another process may have replaced or evicted the entry meanwhile
+        if manifest.get(key) == entry:
+            if df is None: # unreadable entry, drop it so it is rebuilt
+                del manifest[key]
+            else:
+                manifest[key]['last_used'] = time.time()
+            _save_manifest(cache_dir, manifest)
+    return df
+
+def _write_cache(cache_dir, key, df, source, max_bytes=CACHE_MAX_BYTES):
+    """
+    Store df under key, drop stale entries for the same sheet and evict the
+    least recently used entries until the cache is under max_bytes.
+    """
+    # another process may create the folder at the same time
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # data files are written next to their name and renamed into place, so
+    # unlocked readers of a refreshed entry see either version in full
+    fmt, path = None, None
+    if pa is not None:
+        path = os.path.join(cache_dir, key + '.feather')
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        frame = df.copy()
+        frame.columns = ['c{}'.format(i) for i in range(len(df.columns))]
+        frame.index.name = '__index__'
+        try:
+            table = pa.Table.from_pandas(frame.reset_index(), preserve_index=False)
+            table = table.replace_schema_metadata(
+                {b'labels': pickle.dumps((list(df.columns), df.index.name))})
+            feather.write_feather(table, temp, compression='uncompressed')
+            os.replace(temp, path)
+            fmt = 'feather'
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            _remove_quietly(temp) # mixed type column, keep it as a pickle
+    if fmt is None:
+        path = os.path.join(cache_dir, key + '.pkl')
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+        fmt = 'pickle'
+
+    source = list(source)
+    with _manifest_lock(cache_dir):
+        manifest = _load_manifest(cache_dir)
+        for stale in [k for k, entry in manifest.items()
+                      if entry['source'] == source and k != key]:
+            _remove_quietly(os.path.join(cache_dir, manifest.pop(stale)['file']))
+        manifest[key] = {'file': os.path.basename(path), 'format': fmt,
+                         'bytes': os.path.getsize(path), 'source': source,
+                         'last_used': time.time()}
+
+        total = sum(entry['bytes'] for entry in manifest.values())
+        for lru in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+            if total <= max_bytes or lru == key:
+                continue
+            total -= manifest[lru]['bytes']
+            _remove_quietly(os.path.join(cache_dir, manifest.pop(lru)['file']))
+        _save_manifest(cache_dir, manifest)
+
+def clean_dates(df, date_columns=DATE_COLUMNS):
+    """
+    Function coerces the index and the date columns of a dataframe to
+    datetimes in a single pass and drops every row where any of them is
+    missing or not a valid date.  Date columns are matched on their
+    formatted names so it works before or after format_column_names().
+
+    Returns the cleaned dataframe and a dict with the number of rows
+    discarded for each reason, for example:
+        {'invalid MB START': 12, 'invalid mb_end': 3}
+    """
+    index = pd.DatetimeIndex(pd.to_datetime(pd.Series(df.index, dtype=object),
+                                            errors='coerce'), name=df.index.name)
+    keep = index.notna()
+    discarded = {'invalid {}'.format(df.index.name): int((~keep).sum())}
+
+    coerced = {}
+    for col in df.columns:
+        if isinstance(col, str) and _column_name(col) in date_columns:
+            coerced[col] = pd.to_datetime(df[col], errors='coerce')
+            valid = coerced[col].notna().values
+            discarded['invalid {}'.format(col)] = int((keep & ~valid).sum())
+            keep &= valid
+
+    df = df[keep].copy()
+    df.index = index[keep]
+    for col, values in coerced.items():
+        df[col] = values.values[keep]
+    return df, discarded
+
+def fiscal_year(df, date_columns=DATE_COLUMNS):
     """
     Function takes a dataframe with a DateTimeIndex and
     returns dataframe with corresponding fiscal year as a
     four digit year for each date on the index of the dataframe.
-    It drops any rows that do not have a pandas timestamp as
-    its index to match size of dataframe index and the fiscal
-    year list object which is added to dataframe as pandas series.
+    It drops any rows that do not have a valid date as its index
+    or in the date columns (see clean_dates) and prints how many
+    rows were discarded and why.
 
     The function is based on the Maryland Govt fiscal year which
     runs from July 1st to June 30th.
     """
-    for i,idx in enumerate(df.index):
-        if isinstance(idx, pd._libs.tslibs.nattype.NaTType):
-            df.drop(df.index[i],axis=0,inplace=True)
+    df, discarded = clean_dates(df, date_columns=date_columns)
+    for reason, count in discarded.items():
+        if count:
+            print('{} rows discarded: {}'.format(count, reason))
 
     fiscal_year = np.where(df.index.month >= 7,df.index.year+1,df.index.year)
     df['fiscal_year'] = fiscal_year
     return df
 
 
+def apply_schema(df, schema=SCHEMA):
+    """
+    Function converts the columns of df named in schema, a dict of column
+    name --> dtype, to their declared dtype and returns df.  Columns missing
+    from df are skipped, and integer columns are only narrowed when every
+    value fits the smaller type, otherwise they keep their dtype.
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if isinstance(dtype, str) and dtype.startswith('int'):
+            limits = np.iinfo(dtype)
+            values = df[col]
+            if values.isna().any() or values.min() < limits.min or values.max() > limits.max:
+                continue
+        df[col] = df[col].astype(dtype)
+    return df
+
+def memory_report(before, after):
+    """
+    Function compares the memory used by two versions of a dataframe, for
+    example before and after apply_schema(), and returns a dataframe of the
+    dtype and bytes (df.memory_usage(deep=True)) of every column in each,
+    with a total row.
+    """
+    report = pd.DataFrame({'dtype before': before.dtypes.astype(str),
+                           'bytes before': before.memory_usage(deep=True, index=False),
+                           'dtype after': after.dtypes.astype(str),
+                           'bytes after': after.memory_usage(deep=True, index=False)})
+    report.loc['total'] = ['', before.memory_usage(deep=True).sum(),
+                           '', after.memory_usage(deep=True).sum()]
+    return report
+
 def format_column_names(df):
     """
     Function takes dataframe and changes column headers to
-    lower case, replaces spaces with underscores, and drops any
-    columns that are not strings or don't have a lower case
-    attribute."""
+    lower case, strips surrounding spaces, replaces spaces with
+    underscores, and drops any columns that are not strings or don't
+    have a lower case attribute."""
     cols = []
     for col in df.columns:
         try:
             col.lower()
-            cols.append(col.lower().replace(' ','_'))
+            cols.append(_column_name(col))
         except:
             df.drop(col,axis=1,inplace=True)
 
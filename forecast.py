@@ -0,0 +1,151 @@
+"""
+Module for what-if forecasting of contract spending.  It answers questions
+like "what if spend rises 20% next quarter" for the whole portfolio at once
+and works out the change order each contract needs to stay funded until its
+'mb_end' date.
+
+A scenario scales every contract's current monthly burn (mb_$_spent /
+months_passed, as in calculations.run_spending_formulas) from a given month
+on.  Spending is projected as one broadcast over contracts x scenarios x
+months, processed in blocks of contracts so memory stays bounded:
+
+    spent + burn * cumulative_factor[scenario, month]  >  limit
+
+The first month the limit is passed is the exhaustion month of a contract
+under a scenario, and the spend projected at 'mb_end' beyond the limit is
+the change order needed.
+
+    example:
+        scenarios = OrderedDict([('current burn', (1.0, 0)),
+                                 ('+20% next quarter', (1.2, 3))])
+        result = forecast(contracts, scenarios)
+        exhaustion_frame(result, contracts)
+"""
+from collections import OrderedDict, namedtuple
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# custom module for running DGS contract management formulas
+import calculations
+
+# scenario name --> (burn multiplier, month ahead the multiplier starts)
+DEFAULT_SCENARIOS = OrderedDict([
+    ('current burn', (1.0, 0)),
+    ('+20% next quarter', (1.2, 3)),
+    ('+50% next quarter', (1.5, 3)),
+])
+# longest forecast in months
+MAX_HORIZON = 1200
+
+# scenarios         --> scenario names
+# exhaustion_months --> contracts x scenarios, months ahead the spending limit
+#                       is passed, 0 if already passed, -1 if not within the
+#                       horizon
+# exhaustion_dates  --> the same as dates, NaT when not within the horizon
+# projected_spend   --> contracts x scenarios, spend projected at 'mb_end'
+# change_orders     --> contracts x scenarios, projected spend over the limit
+Forecast = namedtuple('Forecast', 'scenarios exhaustion_months exhaustion_dates '
+                                  'projected_spend change_orders')
+
+def scenario_factors(scenarios, months):
+    """
+    Function returns a scenarios x months array of burn multipliers for each
+    month ahead from a dict of scenario name --> (multiplier, start month):
+    1 before the start month and the multiplier from it on.
+    """
+    month = np.arange(months)
+    return np.array([np.where(month >= start, multiplier, 1.0)
+                     for multiplier, start in scenarios.values()], dtype=float).reshape(
+                         len(scenarios), months)
+
+def scenario_grid(low=.5, high=2.0, count=100, start=0):
+    """
+    Function returns count scenarios with burn multipliers evenly spaced
+    from low to high, all starting start months ahead, for sweeping the
+    range of likely spending.
+    """
+    return OrderedDict(('x{:.3f} from month {}'.format(multiplier, start), (multiplier, start))
+                       for multiplier in np.linspace(low, high, count))
+
+def forecast(contracts, scenarios=DEFAULT_SCENARIOS, now=None, horizon=None,
+             chunksize=2000):
+    """
+    Function projects the spending of every contract in a dataframe returned
+    by calculations.get_management_dataframe() under every scenario and
+    returns a Forecast.
+
+    optional arguments:
+        scenarios --> dict   (name --> (burn multiplier, start month), see
+                              DEFAULT_SCENARIOS and scenario_grid())
+        now       --> datetime (start of the forecast, default dt.now())
+        horizon   --> int    (months projected, default the longest
+                              months_left, at most MAX_HORIZON)
+        chunksize --> int    (contracts per block of the broadcast)
+    """
+    now = dt.now() if now is None else now
+    limit = contracts['mb_$_limit'].values.astype(float)
+    spent = contracts['mb_$_spent'].values.astype(float)
+    months_passed = contracts['months_passed'].values.astype(float)
+    # contracts that have not started yet (months_passed 0) have no burn yet
+    burn = np.divide(spent, months_passed, out=np.zeros_like(spent), where=months_passed > 0)
+    months_left = contracts['months_left'].values.astype(int)
+    if horizon is None:
+        horizon = int(months_left.max()) if len(months_left) else 1
+    horizon = int(np.clip(horizon, 1, MAX_HORIZON))
+
+    # cumulative multiple of the current burn spent after each month ahead
+    cumulative = np.cumsum(scenario_factors(scenarios, horizon), axis=1)
+    # multiple of the current burn left before the limit is passed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        headroom = np.where(burn > 0, (limit - spent) / burn, np.inf)
+
+    exhaustion = np.full((len(contracts), len(scenarios)), -1, dtype=int)
+    for begin in range(0, len(contracts), chunksize):
+        block = slice(begin, begin + chunksize)
+        # contracts x scenarios x months
+        passed = cumulative[np.newaxis, :, :] > headroom[block, np.newaxis, np.newaxis]
+        first = passed.argmax(axis=2) + 1
+        # cumulative spend only grows, so passing the limit at all shows in
+        # the last month
+        exhaustion[block] = np.where(passed[:, :, -1], first, -1)
+    exhaustion[spent >= limit] = 0
+
+    # every exhaustion date is now plus whole months: look them up, with the
+    # last entry NaT for -1
+    dates = np.append(calculations.add_months(np.full(horizon + 1, np.datetime64(now, 'ns')),
+                                              np.arange(horizon + 1)),
+                      np.datetime64('NaT', 'ns'))[exhaustion]
+
+    at_end = cumulative[:, np.clip(months_left, 1, horizon) - 1].T
+    projected = spent[:, np.newaxis] + np.where(months_left[:, np.newaxis] > 0,
+                                                burn[:, np.newaxis] * at_end, 0)
+    change_orders = np.maximum(projected - limit[:, np.newaxis], 0)
+    return Forecast(list(scenarios), exhaustion, dates, projected, change_orders)
+
+def change_order_amounts(contracts, scenarios=DEFAULT_SCENARIOS, scenario=None, now=None):
+    """
+    Function returns, for every contract, the smallest change order in whole
+    dollars that keeps it funded until 'mb_end' under scenario, or under
+    every scenario when scenario is None.  Contracts that stay within their
+    limit get 0.  The result is an array in the order of contracts.
+    """
+    result = forecast(contracts, scenarios, now=now)
+    if scenario is None:
+        needed = result.change_orders.max(axis=1) if len(result.scenarios) else 0
+    else:
+        needed = result.change_orders[:, result.scenarios.index(scenario)]
+    return np.ceil(needed)
+
+def exhaustion_frame(result, contracts):
+    """
+    Function returns a dataframe with the po number and, for each scenario,
+    the exhaustion date and change order needed of every contract in a
+    Forecast of contracts.
+    """
+    columns = OrderedDict([('po', contracts['po'].values)])
+    for i, name in enumerate(result.scenarios):
+        columns['{} exhausted'.format(name)] = result.exhaustion_dates[:, i]
+        columns['{} change order'.format(name)] = result.change_orders[:, i]
+    return pd.DataFrame(columns, index=contracts.index)
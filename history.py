@@ -0,0 +1,252 @@
+"""
+Module for keeping a history of the contract ledger so spending trends can
+be tracked between runs.  A single run only sees the current 'mb_$_spent',
+so calculations.run_spending_formulas() can only report the lifetime
+average burn_rate and misses a contract whose spending just spiked.
+
+Each run appends a snapshot of the computed contracts to a folder
+partitioned by the contract's fiscal year (fetcher.fiscal_year):
+
+    .contract_history/
+        fiscal_year=2025/
+            snapshot-20261017T090000.feather
+            trends.feather
+        fiscal_year=2026/
+            ...
+
+Next to the snapshots every partition keeps trends.feather, one row of
+running aggregates per contract.  The trend indicators are updated from the
+latest snapshot and those aggregates alone, so a run reads one small file
+per fiscal year however long the history grows:
+
+    velocity_30d, velocity_90d --> burn over roughly the last 30 and 90
+                                   days in percent of the limit per month,
+                                   comparable to burn_rate.  They are
+                                   exponentially weighted averages of the
+                                   burn between snapshots with 30 and 90 day
+                                   time constants, so runs may be irregular.
+    burn_acceleration          --> velocity_30d - velocity_90d, positive
+                                   when spending is speeding up
+    last_month_spent           --> dollars spent in the last calendar month,
+                                   months bounded by the snapshots
+    mom_delta                  --> last_month_spent minus the month before
+
+A contract seen for the first time starts with both velocities at its
+burn_rate.  Files are Feather when pyarrow is installed, pickle otherwise.
+
+    example:
+        history = SnapshotStore()
+        contracts = history.append(calculations.default_book.computed)
+        contract_parser.partition_watchlists(contracts, contract_parser.ALL_WATCHLISTS)
+"""
+import glob
+import os
+import pickle
+from collections import OrderedDict
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# custom module for running DGS contract management formulas
+import calculations
+# custom module for preparing and returning relevant DGS dataframes
+import fetcher
+
+try:
+    import pyarrow
+except ImportError: # snapshots are stored as pickle files
+    pyarrow = None
+
+HISTORY_DIR = '.contract_history'
+# contract columns kept in each snapshot, with the trend columns
+SNAPSHOT_COLUMNS = ['po', 'mb_$_limit', 'mb_$_spent', 'burn_rate']
+TREND_COLUMNS = ['velocity_30d', 'velocity_90d', 'burn_acceleration',
+                 'last_month_spent', 'mom_delta']
+# rates are float32 like calculations.FORMULA_SCHEMA, dollars stay float64
+TREND_SCHEMA = {'velocity_30d': 'float32', 'velocity_90d': 'float32',
+                'burn_acceleration': 'float32'}
+# velocity column --> time constant in days
+TREND_WINDOWS = OrderedDict([('velocity_30d', 30), ('velocity_90d', 90)])
+# running aggregates stored per contract in trends.feather
+AGGREGATE_COLUMNS = ['po', 'observed', 'spent', 'velocity_30d', 'velocity_90d', 'month',
+                     'month_start_spent', 'last_month_spent', 'prior_month_spent']
+_EXTENSION = '.feather' if pyarrow is not None else '.pkl'
+_DAYS_PER_MONTH = calculations.AVERAGE_MONTH / np.timedelta64(1, 'D')
+
+def _read_frame(path):
+    """
+    Return the dataframe saved at path by _write_frame(), None if missing.
+    """
+    if not os.path.exists(path):
+        return None
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _write_frame(df, path):
+    """
+    Save df, with a default index, at path.  The file is replaced atomically
+    so an interrupted run leaves the previous version in place.
+    """
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    if path.endswith('.feather'):
+        df.reset_index(drop=True).to_feather(temp)
+    else:
+        with open(temp, 'wb') as f:
+            pickle.dump(df.reset_index(drop=True), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+
+def update_trends(previous, snapshot, now):
+    """
+    Function takes the stored aggregates of a partition (None for a new
+    partition), the snapshot of its contracts (po, mb_$_limit, mb_$_spent
+    and burn_rate columns) taken at now, and returns the updated aggregates
+    of the snapshot's contracts in snapshot order, see trend_indicators().
+    Every column is a single array operation.
+    """
+    now = np.datetime64(pd.Timestamp(now), 'ns')
+    month = now.astype('datetime64[M]').astype('datetime64[ns]')
+    spent = snapshot['mb_$_spent'].values.astype(float)
+    limit = snapshot['mb_$_limit'].values.astype(float)
+    burn_rate = snapshot['burn_rate'].values.astype(float)
+    if previous is None:
+        previous = pd.DataFrame(OrderedDict(
+            (col, np.array([], dtype='datetime64[ns]' if col in ('observed', 'month')
+                           else object if col == 'po' else float))
+            for col in AGGREGATE_COLUMNS))
+    previous = previous.drop_duplicates('po', keep='last').set_index('po')
+    prior = previous.reindex(snapshot['po'].values)
+    new = prior['observed'].isna().values
+
+    observed = prior['observed'].values.astype('datetime64[ns]')
+    months = (now - observed) / calculations.AVERAGE_MONTH.astype('timedelta64[ns]')
+    elapsed = ~new & (months > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(elapsed, (spent - prior['spent'].values.astype(float)) /
+                        limit * 100 / months, 0)
+
+    trends = OrderedDict([('po', snapshot['po'].values),
+                          ('observed', np.full(len(snapshot), now)), ('spent', spent)])
+    for col, days in TREND_WINDOWS.items():
+        weight = np.where(elapsed, -np.expm1(-months * _DAYS_PER_MONTH / days), 0)
+        velocity = prior[col].values.astype(float)
+        trends[col] = np.where(new, burn_rate, velocity + weight * (rate - velocity))
+
+    # the first snapshot in a new month closes the month of the one before
+    rolled = ~new & (prior['month'].values.astype('datetime64[ns]') < month)
+    previous_spent = prior['spent'].values.astype(float)
+    month_start = prior['month_start_spent'].values.astype(float)
+    last_month = prior['last_month_spent'].values.astype(float)
+    trends['month'] = np.full(len(snapshot), month)
+    trends['month_start_spent'] = np.where(new, spent,
+                                           np.where(rolled, previous_spent, month_start))
+    trends['last_month_spent'] = np.where(rolled, previous_spent - month_start, last_month)
+    trends['prior_month_spent'] = np.where(rolled, last_month,
+                                           prior['prior_month_spent'].values.astype(float))
+    return pd.DataFrame(trends, index=snapshot.index)
+
+def trend_indicators(aggregates):
+    """
+    Return the TREND_COLUMNS of a frame of aggregates from update_trends()
+    in the dtypes of TREND_SCHEMA.
+    """
+    return fetcher.apply_schema(pd.DataFrame(OrderedDict([
+        ('velocity_30d', aggregates['velocity_30d']),
+        ('velocity_90d', aggregates['velocity_90d']),
+        ('burn_acceleration', aggregates['velocity_30d'] - aggregates['velocity_90d']),
+        ('last_month_spent', aggregates['last_month_spent']),
+        ('mom_delta', aggregates['last_month_spent'] - aggregates['prior_month_spent']),
+    ]), index=aggregates.index), TREND_SCHEMA)
+
+class SnapshotStore(object):
+    """
+    Snapshots of the computed contracts partitioned by fiscal year.
+    ----------------------------------------------------------------
+    folder defaults to HISTORY_DIR; use one folder per ledger, for example
+    per agency, as contracts are matched on their po number.
+    """
+    def __init__(self, folder=HISTORY_DIR):
+        self.folder = folder
+
+    def _partition(self, fiscal_year):
+        return os.path.join(self.folder, 'fiscal_year={}'.format(fiscal_year))
+
+    def partitions(self):
+        """
+        Return the fiscal years stored, oldest first.
+        """
+        return sorted(int(os.path.basename(path).split('=', 1)[1])
+                      for path in glob.glob(os.path.join(self.folder, 'fiscal_year=*')))
+
+    def append(self, contracts, now=None):
+        """
+        Function saves a snapshot of contracts, a frame returned by
+        calculations.get_management_dataframe(), taken at now (default
+        dt.now()) in the partition of each contract's fiscal year, updates
+        the partitions' aggregates and returns a copy of contracts with the
+        TREND_COLUMNS added.
+        """
+        now = dt.now() if now is None else now
+        indicators = pd.DataFrame(np.nan, index=np.arange(len(contracts)), columns=TREND_COLUMNS)
+        positions = contracts.groupby('fiscal_year', sort=False).indices
+        for fiscal_year, rows in positions.items():
+            snapshot = contracts.iloc[rows][SNAPSHOT_COLUMNS].reset_index(drop=True)
+            partition = self._partition(fiscal_year)
+            if not os.path.exists(partition):
+                os.makedirs(partition)
+            path = os.path.join(partition, 'trends' + _EXTENSION)
+            previous = _read_frame(path)
+            aggregates = update_trends(previous, snapshot, now)
+            trends = trend_indicators(aggregates)
+            for col in TREND_COLUMNS:
+                snapshot[col] = trends[col]
+            _write_frame(snapshot, os.path.join(partition, 'snapshot-{}{}'.format(
+                pd.Timestamp(now).strftime('%Y%m%dT%H%M%S'), _EXTENSION)))
+            # contracts missing from this snapshot keep their last aggregates
+            if previous is not None:
+                aggregates = pd.concat([previous, aggregates], ignore_index=True)
+                aggregates = aggregates.drop_duplicates('po', keep='last')
+            _write_frame(aggregates[AGGREGATE_COLUMNS], path)
+            indicators.iloc[rows] = trends.values
+
+        contracts = contracts.copy()
+        for col in TREND_COLUMNS:
+            contracts[col] = indicators[col].values
+        print('contract snapshot saved to {} fiscal year partitions'.format(len(positions)))
+        return fetcher.apply_schema(contracts, TREND_SCHEMA)
+
+    def snapshots(self, fiscal_year=None):
+        """
+        Return every stored snapshot, or those of one fiscal year, as one
+        frame with 'fiscal_year' and 'snapshot' date columns, for analysis.
+        This reads the whole history, unlike append().
+        """
+        years = self.partitions() if fiscal_year is None else [fiscal_year]
+        frames = []
+        for year in years:
+            for path in sorted(glob.glob(os.path.join(self._partition(year),
+                                                      'snapshot-*' + _EXTENSION))):
+                frame = _read_frame(path)
+                stamp = os.path.basename(path)[len('snapshot-'):-len(_EXTENSION)]
+                frame.insert(0, 'snapshot', pd.Timestamp(stamp))
+                frame.insert(0, 'fiscal_year', year)
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=['fiscal_year', 'snapshot'] + SNAPSHOT_COLUMNS +
+                                TREND_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def drop(self, fiscal_year):
+        """
+        Delete the snapshots and aggregates of a fiscal year and return the
+        number of files removed.
+        """
+        partition = self._partition(fiscal_year)
+        files = glob.glob(os.path.join(partition, '*'))
+        for path in files:
+            os.remove(path)
+        if os.path.isdir(partition):
+            os.rmdir(partition)
+        return len(files)
@@ -6,153 +6,188 @@ for the reports.
 """
 import configparser
 import os
-import smtplib
 import sys
 
 from datetime import datetime as dt
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 
+import calculations # custom module for running DGS contract management formulas
 import contract_parser # custom module for parsing target crieteria
+import delivery # concurrent delivery of the division emails
+import transport # pooled SMTP connections for sending the emails
 import wiper # module for cleaning sucessfully emailed files from temp folder
 
-def send_emails():
+# largest encoded message accepted by Gmail
+MAX_MESSAGE_BYTES = 25 * 1024 ** 2
+
+def load_config(path='configuration/config.ini'):
+    """
+    Function reads and returns the program's ConfigParser configuration.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+def make_memos_email(memos, config, agency='DGS', recipient=None, count=None, part=None):
+    """
+    Function takes the list of change order memo files to be sent as attachments
+    and the program configuration.
+
+    It constructs an email notifying which contracts require a change order,
+    attaches every memo and returns the message for delivery.  count is the
+    number of memos reported in the message and defaults to the number of
+    files, pass it when the memos are combined into a single pdf.  part is an
+    optional (number, total) pair added to the subject when the memos are
+    split over several emails.  The email recipient defaults to the
+    configured email address.
+    """
+    sender = config['Email']['email_address']
+    recipient = recipient or config['Email']['email_address']
+
+    # change recipient to AP contract manager
+    subject = '{} Change Order Memos : Contract Management {}'.format(agency,
+        dt.today().strftime('%m-%d-%y'))
+    if part is not None:
+        subject += ' (part {} of {})'.format(*part)
+    body = 'Attached please find {} auto generated change order memos for the contracts meeting \
+the calendar, burn rate or spending limit conditions that would require a change order. \
+Please do not hesitate to contact appropriate Accounts Payable staff if you have questions. \
+\n\n\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t****'.format(len(memos) if count is None else count)
+
+    # memo files are read and encoded only while the message is sent
+    return transport.StreamingMessage(sender, recipient, subject, body, memos)
+
+def make_memos_emails(memos, config, max_bytes=MAX_MESSAGE_BYTES, **kwargs):
+    """
+    Function splits the memo files over as many emails as needed to keep each
+    one within max_bytes once encoded and returns the list of messages built
+    by make_memos_email(), which receives the other keyword arguments.
+    """
+    batches = transport.split_attachments(memos, max_bytes)
+    if len(batches) == 1:
+        return [make_memos_email(batches[0], config, **kwargs)]
+    return [make_memos_email(batch, config, part=(i, len(batches)), **kwargs)
+            for i, batch in enumerate(batches, 1)]
+
+def make_contract_list_email(file, division, config, recipient=None):
+    """
+    Function takes the name of the file to be sent as an attachment, the name
+    of the division using the contracts in the file and the program
+    configuration.
+
+    It constructs an email notifying which contracts require action due to having
+    a high burn rate and or approaching expiration, attaches the relevant
+    excel file and returns the message for delivery.  The email recipient
+    defaults to the configured email address.
+    """
+    sender = config['Email']['email_address']
+    recipient = recipient or config['Email']['email_address']
+
+    # change recipient to AP contract manager
+    subject = '{} Contract Management Watchlist {}'.format(division,
+        dt.today().strftime('%m-%d-%y'))
+    body = 'Attached please find the contract management report for \
+your division indicating those contracts requiring your attention due to:\n\
+\t1) a high burn rate, and or\n\t2) approaching contract expiration.'
+
+    return transport.StreamingMessage(sender, recipient, subject, body, [file])
+
+def workbook_division(workbook):
     """
-    Function uses an SMTP connection to send emails with Gmail. Function sends
-    one email for each of the divisions using contracts and attaches a separate
-    excel workbook file with contract management watchlist spreadhseets for: high
-    burning contracts, contracts expiring in 3 months and, contracts expiring in
-    6 months for each division. The other email the function sends is a message
-    containing change order memos as attachments for each contract in need of
-    a change order.
+    Return the division name encoded in a watchlist workbook filename.
+    """
+    return os.path.basename(workbook).split('-')[0].capitalize()
+
+def deliver_reports(workbooks, memos, config=None, memo_count=None,
+                    concurrency=None, retries=None, agency=None):
+    """
+    Function emails already generated reports: one message with the change
+    order memos (skipped when there are none) and one message per division
+    watchlist workbook.  Messages go out over one pooled SMTP session through
+    the delivery module, with at most concurrency messages in flight and up to
+    retries further attempts per message.  Both default to the concurrency and
+    retries options of the [SMTP] config section (5 and 3).  The memos are
+    split over several messages when needed to keep each one within the
+    max_message_bytes option of the [SMTP] section (default 25 MB).  agency
+    names the agency in the memo subject (default DGS) and, when given,
+    prefixes the division in the watchlist subjects.
+
+    Function returns the list of delivery.DeliveryResult for the messages, the
+    memo message first, so callers know exactly which files were sent.
+    """
+    config = load_config() if config is None else config
+    smtp = config['SMTP'] if config.has_section('SMTP') else config['DEFAULT']
+
+    concurrency = smtp.getint('concurrency', 5) if concurrency is None else concurrency
+
+    outbox = []
+    if memos:
+        for msg in make_memos_emails(memos, config, count=memo_count, agency=agency or 'DGS',
+                max_bytes=smtp.getint('max_message_bytes', MAX_MESSAGE_BYTES)):
+            outbox.append(('change order memos', msg, msg.attachments))
+    for workbook in workbooks:
+        division = workbook_division(workbook)
+        if agency:
+            division = '{} {}'.format(agency, division)
+        outbox.append((division, make_contract_list_email(workbook, division, config),
+                       [workbook]))
+
+    # pooled, authenticated SMTP sessions reused by every email of the run
+    with transport.SMTPTransport.from_config(config) as mail:
+        results = delivery.deliver(outbox, mail, concurrency=concurrency,
+            retries=smtp.getint('retries', 3) if retries is None else retries)
+
+    for result in results:
+        if result.sent:
+            print('{} message sent with {} files'.format(result.key, len(result.files)))
+        else:
+            print('***{} message failed after {} attempts: {}***'.format(
+                result.key, result.attempts, result.error))
+    return results
+
+def send_emails(combined_memos=False, concurrency=None, retries=None):
+    """
+    Function uses an SMTP connection to send emails with Gmail, or the server
+    configured in the [SMTP] section of configuration/config.ini.  A single
+    authenticated session is opened for the run and reused for every email.
+    Function sends one email for each of the divisions using contracts and
+    attaches a separate excel workbook file with contract management watchlist
+    spreadhseets for: high burning contracts, contracts expiring in 3 months
+    and, contracts expiring in 6 months for each division. The other email the
+    function sends is a message containing change order memos as attachments
+    for each contract in need of a change order.
 
     It performs 3 main tasks:
         1. emails the target reports from their location in temporary folder
         2. returns a list of all files sucessfully attached and emailed
         3. deletes sucessfully sent files from temporary folder
 
-    The email recipient is set as a default value in the make_contract_list_email() function.
-    It can be changed by passing a valid email address to the recipient
-    parameter.
+    With combined_memos=True the change order memos are sent as a single pdf
+    with a linked index and division bookmarks instead of one file per memo.
+
+    Emails are delivered concurrently by deliver_reports(), see there for the
+    concurrency and retries arguments.  A division whose email fails is
+    reported and its workbook kept in the temporary folder; the others still
+    go out.
 
     It relies upon the make_contract_list_email() or make_memos_email() function
     to generate the template for each email and relies upon the contract_parser
     module which evaluates each active contract to determine if they meet the
     above watchlist criteria and returns excel workbook files for each division.
-    The make_contract_list_email() function takes advantage of the naming
+    The workbook_division() function takes advantage of the naming
     convention for generating files in the contract_parser module's
     generate_watchlist_workbooks() method to indicate the relevant division in
-    the email subject line and to provide access to the list of files generated
-    for each division as return value of the function.
+    the email subject line.
     """
     sent_files = []
-    config = configparser.ConfigParser()
-    config.read('configuration/config.ini')
-
-    def make_memos_email(agency='DGS', recipient=config['Email']['email_address']):
-        """
-        Function takes 2 parameters, the name of the file to be sent as an attachment
-        and the name of the division using the contracts in the file.
-
-        It constructs an email notifying which contracts require action due to having
-        a high burn rate and or approaching expiration and attaches the relevant
-        excel file.  The email is built using Gmail
-        """
-        sender = config['Email']['email_address']
-        password = config['Email']['password']
-
-        memos = contract_parser.generate_pdfs()
-
-        msg = MIMEMultipart()
-        # change recipient to AP contract manager
-        msg['To'] =  recipient
-        msg['From'] = sender
-        msg['Subject'] = '{} Change Order Memos : Contract Management {}'.format(agency,
-            dt.today().strftime('%m-%d-%y'))
-        body = MIMEText(
-    'Attached please find {} auto generated change order memos for the contracts meeting \
-the calendar, burn rate or spending limit conditions that would require a change order. \
-Please do not hesitate to contact appropriate Accounts Payable staff if you have questions. \
-\n\n\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t****'.format(len(memos)))
-        msg.attach(body)
-
-        for i, file in enumerate(memos):
-            with open(file, 'rb') as f:
-                payload = MIMEBase('application', 'octet-stream')
-                payload.set_payload(f.read())
-                encoders.encode_base64(payload) # encode into base64
-                payload.add_header('Content-Disposition',
-                                  'attachment; filename={}'.format(file.split('/')[1]))
-                msg.attach(payload) # attach payload MIMEBase instance to the message
-
-        smtpObj = smtplib.SMTP('smtp.gmail.com',587)
-        smtpObj.ehlo()
-        smtpObj.starttls()
-        smtpObj.login(sender, password)
-        smtpObj.sendmail(msg['From'],msg['To'],msg.as_string())
-        smtpObj.quit()
-        print('{} files sent'.format(i+1))
-#         sent_files.append(file) # add sucessfully sent files to list
-
-
-    def make_contract_list_email(file, division, recipient=config['Email']['email_address']):
-        """
-        Function takes 2 parameters, the name of the file to be sent as an attachment
-        and the name of the division using the contracts in the file.
-
-        It constructs an email notifying which contracts require action due to having
-        a high burn rate and or approaching expiration and attaches the relevant
-        excel file.  The email is built using Gmail
-        """
-        sender = config['Email']['email_address']
-        password = config['Email']['password']
-
-        msg = MIMEMultipart()
-        # change recipient to AP contract manager
-        msg['To'] =  recipient
-        msg['From'] = sender
-        msg['Subject'] = '{} Contract Management Watchlist {}'.format(division,
-            dt.today().strftime('%m-%d-%y'))
-        body = MIMEText(
-    'Attached please find the contract management report for \
-your division indicating those contracts requiring your attention due to:\n\
-\t1) a high burn rate, and or\n\t2) approaching contract expiration.')
-        msg.attach(body)
-
-        with open(file, 'rb') as f:
-            payload = MIMEBase('application', 'octet-stream')
-            payload.set_payload(f.read())
-            encoders.encode_base64(payload) # encode into base64
-            payload.add_header('Content-Disposition',
-                              'attachment; filename={}'.format(file.split('/')[1]))
-            msg.attach(payload) # attach payload MIMEBase instance to the message
-
-        smtpObj = smtplib.SMTP('smtp.gmail.com',587)
-        smtpObj.ehlo()
-        smtpObj.starttls()
-        smtpObj.login(sender, password)
-        smtpObj.sendmail(msg['From'],msg['To'],msg.as_string())
-        smtpObj.quit()
-        print('{} message sent'.format(division))
-        sent_files.append(file) # add sucessfully sent files to list
-
-    # generate email with change order memos for agency
+    workbooks, memos, memo_count = [], [], None
     try:
-        make_memos_email()
-    except Exception as e:
-        e_type,e_obj,e_traceback = sys.exc_info()
-        print('***{} is causing problems***'.format(str(e_traceback.tb_frame.f_code).split()[2]))
-
-        print('Failure in object: {}\n'.format(e_traceback.tb_frame.f_code))
-        print('Error type: {}\nError Message: {}\nError Location: line {}'.format(
-            str(e_type).split("'")[1], e_obj, e_traceback.tb_lineno))
-
-    # generate emails with contract watchlist for each division
-    try:
-        for workbook in contract_parser.generate_watchlist_workbooks():
-            make_contract_list_email(file=workbook, division=workbook.split('/')[1].split('-')[0].capitalize())
+        if combined_memos:
+            memo_count = len(contract_parser.memo_arguments(
+                calculations.default_book.computed))
+            memos = [contract_parser.generate_combined_memo()] if memo_count else []
+        else:
+            memos = contract_parser.generate_pdfs()
+        workbooks = contract_parser.generate_watchlist_workbooks()
     except Exception as e:
         # for help debugging
         e_type,e_obj,e_traceback = sys.exc_info()
@@ -162,6 +197,11 @@ your division indicating those contracts requiring your attention due to:\n\
         print('Error type: {}\nError Message: {}\nError Location: line {}'.format(
             str(e_type).split("'")[1], e_obj, e_traceback.tb_lineno))
 
+    results = deliver_reports(workbooks, memos, memo_count=memo_count,
+                              concurrency=concurrency, retries=retries)
+    sent_files = [file for result in results if result.sent
+                  for file in result.files if file in workbooks]
+
     # wipe files from sucessfully sent messages & track files failing to send
     clean_folder = wiper.clean_temporary_folder(outbound_files=sent_files)
     clean_folder
@@ -0,0 +1,186 @@
+"""
+Module for instrumenting a contract management run.  A RunMetrics object
+times each pipeline stage, records the memory it used and keeps counters
+such as rows loaded, contracts flagged, files written, bytes sent and send
+failures, then writes them out as a JSON run report and, optionally, as a
+Prometheus textfile for the node exporter's textfile collector.
+
+Each stage records the process' resident set size high-water mark when it
+ends.  That is the peak since the process started, not the peak of the
+stage: every stage after the largest one reports the same value.  With
+trace_memory=True each stage also gets its own peak python allocation,
+measured by tracemalloc with the peak reset when the stage starts, and with
+profile=True the run is profiled with cProfile; both slow the run down and
+are meant for investigating a slow night, not for every run.
+
+    example:
+        metrics = RunMetrics()
+        with metrics.stage('load'):
+            df = load()
+        metrics.count('rows_loaded', len(df))
+        metrics.write_json('run_report.json')
+"""
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime as dt
+
+try:
+    import resource
+except ImportError: # not available on windows, peak rss is not reported
+    resource = None
+
+try:
+    from prometheus_client import CollectorRegistry, Gauge, write_to_textfile
+except ImportError: # write_prometheus() is unavailable
+    CollectorRegistry = None
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process since it started in
+    bytes, None when it cannot be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class RunMetrics(object):
+    """
+    Stage timings, memory and counters of one run.
+    ----------------------------------------------
+    optional arguments:
+        trace_memory --> bool  (peak python memory of each stage with
+                                tracemalloc, the only per-stage peak)
+        profile      --> bool  (profile the stages with cProfile, see
+                                write_profile())
+    """
+    def __init__(self, trace_memory=False, profile=False):
+        self.started = dt.now()
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block and record it as stage name.  A stage
+        entered again, e.g. once per agency, accumulates its seconds.
+        """
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            if self.profiler is not None:
+                self.profiler.disable()
+            record = self.stages.setdefault(name, OrderedDict([('seconds', 0.0)]))
+            record['seconds'] += seconds
+            record['rss_high_water_bytes'] = peak_rss()
+            if self.trace_memory:
+                record['peak_traced_bytes'] = max(record.get('peak_traced_bytes', 0),
+                                                  tracemalloc.get_traced_memory()[1])
+
+    def stop(self):
+        """
+        Stop the memory tracing started by stage() when trace_memory is set.
+        """
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def count(self, name, value=1):
+        """
+        Add value to the counter called name.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timings(self):
+        """
+        Return an ordered dict of stage name --> seconds.
+        """
+        return OrderedDict((name, record['seconds']) for name, record in self.stages.items())
+
+    def report(self):
+        """
+        Return the run report as a dict ready for JSON.
+        """
+        return OrderedDict([('started', self.started.isoformat(timespec='seconds')),
+                            ('seconds', sum(r['seconds'] for r in self.stages.values())),
+                            ('peak_rss_bytes', peak_rss()),
+                            ('stages', self.stages), ('counters', self.counters)])
+
+    def print_summary(self):
+        """
+        Print the seconds of every stage, the total and the counters.
+        """
+        for name, seconds in self.timings().items():
+            print('{:<18}{:9.3f} s'.format(name, seconds))
+        print('{:<18}{:9.3f} s'.format('total', sum(self.timings().values())))
+        for name, value in self.counters.items():
+            print('{:<24}{:>12,}'.format(name, value))
+
+    def write_json(self, path):
+        """
+        Save the run report as JSON to path and return path.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        return path
+
+    def write_prometheus(self, path, job='contract_manager'):
+        """
+        Save the stage timings and memory and the counters as a Prometheus
+        textfile at path (requires prometheus-client) and return path.
+        The file is replaced atomically so a collector never reads it half
+        written.
+        """
+        if CollectorRegistry is None:
+            raise ImportError('writing Prometheus metrics requires the prometheus-client package')
+        registry = CollectorRegistry()
+        seconds = Gauge('{}_stage_seconds'.format(job), 'Wall time of a run stage',
+                        ['stage'], registry=registry)
+        rss = Gauge('{}_stage_rss_high_water_bytes'.format(job),
+                    'Peak resident memory of the process since it started, at the '
+                    'end of a run stage', ['stage'], registry=registry)
+        for name, record in self.stages.items():
+            seconds.labels(stage=name).set(record['seconds'])
+            if record.get('rss_high_water_bytes') is not None:
+                rss.labels(stage=name).set(record['rss_high_water_bytes'])
+        counters = Gauge('{}_run_total'.format(job), 'Counters of the last run', ['counter'],
+                         registry=registry)
+        for name, value in self.counters.items():
+            counters.labels(counter=name).set(value)
+        Gauge('{}_last_run_timestamp_seconds'.format(job), 'Start time of the last run',
+              registry=registry).set(time.mktime(self.started.timetuple()))
+        write_to_textfile(path, registry)
+        return path
+
+    def write_profile(self, path, top=25):
+        """
+        Save the cProfile statistics of a profiled run to path, for snakeviz
+        or pstats, print the top functions by cumulative time and return
+        path.  Only the main thread is profiled, work done in delivery
+        threads or worker processes shows up as time spent waiting.
+        """
+        if self.profiler is None:
+            raise ValueError('the run was not profiled, create RunMetrics(profile=True)')
+        self.profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        print(out.getvalue())
+        return path
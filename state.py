@@ -0,0 +1,127 @@
+"""
+Module for remembering what each contract looked like when it was last
+reported so daily runs can notify only about contracts that changed.
+
+The state is a SQLite database keyed on the contract's po number.  For
+every contract it stores two row hashes:
+    input_hash  --> the contract as read from the workbook (start date and
+                    every column that is not a formula column or a trend
+                    column added by history.SnapshotStore)
+    state_hash  --> the indicators the notifications depend on, see
+                    STATE_COLUMNS
+
+A contract has changed when it is new or either hash differs from the one
+recorded after its last successful notification.  The indicators are
+hashed as well as the inputs because months_left moves with the calendar:
+an untouched contract still changes once it crosses into a new month or
+watchlist.
+
+    example:
+        with ContractState() as state:
+            changed = state.changed(contracts)
+            ...report on changed...
+            state.record(changed)
+"""
+import sqlite3
+from datetime import datetime as dt
+
+import pandas as pd
+
+# custom module for running DGS contract management formulas
+import calculations
+# snapshot history whose trend columns move on every run
+import history
+
+STATE_DB = '.contract_state.sqlite'
+# computed indicators a notification depends on
+STATE_COLUMNS = ['burn_status', 'months_left', 'watch_list_75%_spent']
+
+class ContractState(object):
+    """
+    SQLite store of the row hashes of the contracts last reported.
+    ---------------------------------------------------------------
+    example:
+        with ContractState('.contract_state.sqlite') as state:
+            state.changed(contracts)
+    """
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS contract_state ('
+            'po TEXT PRIMARY KEY, input_hash INTEGER NOT NULL, '
+            'state_hash INTEGER NOT NULL, recorded TEXT NOT NULL)')
+
+    def stored(self):
+        """
+        Return the recorded hashes as a dataframe indexed by po.
+        """
+        return pd.read_sql_query('SELECT po, input_hash, state_hash FROM contract_state',
+                                 self.connection, index_col='po')
+
+    def changed(self, contracts):
+        """
+        Function returns the rows of the contracts dataframe, computed by
+        calculations.get_management_dataframe(), that are new or differ
+        from the recorded state in their inputs or indicators.
+        """
+        hashes = contract_hashes(contracts)
+        stored = self.stored().reindex(hashes.index)
+        differs = ((hashes['input_hash'] != stored['input_hash']) |
+                   (hashes['state_hash'] != stored['state_hash']))
+        return contracts[contracts['po'].astype(str).isin(hashes.index[differs])]
+
+    def record(self, contracts):
+        """
+        Save the current hashes of the contracts, typically those just
+        notified, replacing what was recorded for their po numbers.  Returns
+        the number of contracts recorded.
+        """
+        hashes = contract_hashes(contracts)
+        recorded = dt.now().isoformat(timespec='seconds')
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO contract_state VALUES (?, ?, ?, ?)',
+                [(po, int(input_hash), int(state_hash), recorded)
+                 for po, input_hash, state_hash in hashes.itertuples()])
+        return len(hashes)
+
+    def forget(self, po_numbers=None):
+        """
+        Remove the recorded state of po_numbers (default every contract) so
+        they are reported again on the next run.
+        """
+        with self.connection:
+            if po_numbers is None:
+                self.connection.execute('DELETE FROM contract_state')
+            else:
+                self.connection.executemany('DELETE FROM contract_state WHERE po = ?',
+                                            [(str(po),) for po in po_numbers])
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def contract_hashes(contracts):
+    """
+    Function returns a dataframe indexed by po with the input_hash and
+    state_hash of every contract, each hash computed for all rows at once
+    with pd.util.hash_pandas_object.  Rows sharing a po number are combined
+    into one hash per po.
+    """
+    derived = calculations.FORMULA_COLUMNS + history.TREND_COLUMNS
+    inputs = contracts.drop(columns=[col for col in derived if col in contracts.columns])
+    hashes = pd.DataFrame({
+        'po': contracts['po'].astype(str).values,
+        'input_hash': pd.util.hash_pandas_object(inputs, index=True).values,
+        'state_hash': pd.util.hash_pandas_object(contracts[STATE_COLUMNS],
+                                                 index=False).values})
+    hashes = hashes.groupby('po', sort=False).sum()
+    # SQLite integers are signed 64 bit
+    return pd.DataFrame(hashes.values.astype('uint64').view('int64'),
+                        index=hashes.index, columns=hashes.columns)
@@ -0,0 +1,46 @@
+"""
+Shared fixtures for the test suite.  The program is a folder of top level
+modules run from the project folder, so the tests put it on sys.path and
+run anything that reads project files (images, configuration) from there.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# evaluation date used by the tests, mid morning so no contract ends exactly on it
+NOW = pd.Timestamp('2026-10-17 09:30:00')
+
+@pytest.fixture
+def project_dir(monkeypatch):
+    """
+    Run the test from the project folder.
+    """
+    monkeypatch.chdir(ROOT)
+    return ROOT
+
+@pytest.fixture
+def make_contracts():
+    """
+    Return a function building a random contracts frame shaped like the
+    fetcher.fiscal_year() output: indexed to the master blanket start date
+    with po, description, division, mb_end, mb_$_limit and mb_$_spent.
+    """
+    def make(rows=200, seed=0, now=NOW):
+        rng = np.random.RandomState(seed)
+        start = now - pd.to_timedelta(rng.randint(0, 4 * 365 * 24, rows), unit='h')
+        end = start + pd.to_timedelta(rng.randint(200 * 24, 6 * 365 * 24, rows), unit='h')
+        limit = rng.randint(1000, 2000000, rows)
+        spent = (limit * rng.uniform(0, 1.2, rows)).astype(int)
+        spent[::17] = 0
+        return pd.DataFrame({'po': ['P{:07d}'.format(i) for i in range(rows)],
+                             'description': 'Test contract',
+                             'division': rng.choice(['Fleet', 'Energy', 'Facilities'], rows),
+                             'mb_end': end, 'mb_$_limit': limit, 'mb_$_spent': spent},
+                            index=pd.DatetimeIndex(start, name='MB START'))
+    return make
@@ -0,0 +1,34 @@
+import app
+import calculations
+import contract_parser
+import delivery
+from conftest import NOW
+
+def _computed(make_contracts):
+    contracts = calculations.run_spending_formulas(
+        calculations.run_duration_formulas(make_contracts(300), now=NOW))
+    return contracts[contracts['mb_end'] > NOW]
+
+def test_delivered_contracts_skip_divisions_that_failed_to_render(make_contracts, monkeypatch,
+                                                                   tmp_path):
+    monkeypatch.chdir(tmp_path)
+    contracts = _computed(make_contracts)
+    def fail_fleet(filename, sheets, engine=None):
+        if filename == contract_parser.watchlist_filename('Fleet'):
+            raise ValueError('cannot render')
+        return filename
+    monkeypatch.setattr(contract_parser, 'write_watchlist_workbook', fail_fleet)
+    workbooks = contract_parser.generate_watchlist_workbooks(contracts)
+    assert contract_parser.watchlist_filename('Fleet') not in workbooks
+    memos = ['changeorder_memos/P1-changeorder-amount.pdf']
+    results = [delivery.DeliveryResult('change order memos', memos, True, 1, None)]
+    results += [delivery.DeliveryResult(name, [name], True, 1, None) for name in workbooks]
+
+    delivered = app.delivered_contracts(contracts, results, memos)
+    assert len(delivered) == (contracts['division'] != 'Fleet').sum() > 0
+    assert (delivered['division'] != 'Fleet').all()
+
+    # high burning contracts also need their memos sent
+    delivered = app.delivered_contracts(contracts, results[1:], memos)
+    assert len(delivered) == ((contracts['division'] != 'Fleet') &
+                              (contracts['burn_status'] != 'high')).sum()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+import calculations
+from conftest import NOW
+
+def test_add_months_matches_dateoffset():
+    rng = np.random.RandomState(1)
+    dates = (pd.Timestamp('1990-01-01') +
+             pd.to_timedelta(rng.randint(0, 40 * 365 * 86400, 20000), unit='s'))
+    months = rng.randint(-240, 240, 20000)
+    shifted = calculations.add_months(dates.values, months)
+    expected = [date + pd.DateOffset(months=int(n)) for date, n in zip(dates, months)]
+    assert (pd.DatetimeIndex(shifted) == pd.DatetimeIndex(expected)).all()
+
+def test_add_months_clips_to_month_end_and_keeps_time():
+    dates = pd.to_datetime(['2019-01-31 13:45', '2020-01-31 00:00', '2019-03-31 00:00'])
+    shifted = pd.DatetimeIndex(calculations.add_months(dates.values, [1, 1, -1]))
+    assert list(shifted) == list(pd.to_datetime(['2019-02-28 13:45', '2020-02-29 00:00',
+                                                 '2019-02-28 00:00']))
+
+def test_add_months_out_of_range_is_nat():
+    shifted = calculations.add_months(pd.to_datetime(['2020-01-01']).values,
+                                      [calculations.MAX_MONTHS])
+    assert np.isnat(shifted[0])
+
+def test_months_between_average_months():
+    start = pd.to_datetime(['2020-01-01']).values
+    end = (pd.Timestamp('2020-01-01') + 3 * pd.Timedelta(calculations.AVERAGE_MONTH)).to_numpy()
+    assert np.allclose(calculations.months_between(start, [end]), 3)
+
+def test_formulas_match_row_by_row(make_contracts):
+    df = make_contracts(100)
+    computed = calculations.run_spending_formulas(
+        calculations.run_duration_formulas(df.copy(), now=NOW))
+    month = pd.Timedelta(calculations.AVERAGE_MONTH)
+    for start, row in computed.iterrows():
+        assert row['duration_months'] == round((row['mb_end'] - start) / month)
+        assert row['months_left'] == np.ceil((row['mb_end'] - NOW) / month)
+        passed = int(np.floor((NOW - start) / month))
+        assert row['months_passed'] == (passed if passed >= 1 else passed + 1)
+        burn = row['mb_$_spent'] / row['months_passed'] / row['mb_$_limit'] * 100
+        assert np.isclose(row['burn_rate'], burn)
+        if row['mb_$_spent']:
+            estimate = int(np.floor(row['mb_$_limit'] /
+                                    (row['mb_$_spent'] / row['months_passed'])))
+        else:
+            estimate = 0
+        expected = start + pd.DateOffset(months=estimate)
+        if expected < pd.Timestamp.max - pd.Timedelta(days=31):
+            assert row['projected_limit_date'] == expected
+        else: # beyond the range of nanosecond timestamps
+            assert pd.isna(row['projected_limit_date'])
@@ -0,0 +1,67 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pypdf
+import pytest
+
+import contract_parser
+
+def test_combined_memo_outline(project_dir):
+    contracts = pd.DataFrame({
+        'po': ['P2', 'P1', 'P3', 'P4'], 'description': 'Test contract',
+        'division': ['Fleet', 'Fleet', 'Energy', 'Energy'],
+        'burn_status': ['high', 'high', 'high', 'low'], 'months_left': [5, 6, 7, 8],
+        'pct_spent': [80.0, 70.0, 60.0, 10.0], 'mb_$_limit': [1000, 2000, 3000, 4000],
+        'mb_end': pd.to_datetime(['2027-01-01'] * 4)})
+    name = contract_parser.generate_combined_memo(contracts=contracts)
+    with open(name, 'rb') as f:
+        reader = pypdf.PdfReader(io.BytesIO(f.read()))
+    os.remove(name)
+    # index page then one page per memo, sorted by division and po
+    assert len(reader.pages) == 4
+    outline = reader.outline
+    titles = [(item.title, [child.title for child in children])
+              for item, children in zip(outline[::2], outline[1::2])]
+    assert titles == [('Energy', ['P3']), ('Fleet', ['P1', 'P2'])]
+    assert [reader.get_destination_page_number(child) for child in outline[3]] == [2, 3]
+    # every index entry links to its memo page
+    links = [annot.get_object() for annot in reader.pages[0]['/Annots']]
+    assert len(links) == 3 * 3
+
+@pytest.mark.parametrize('engine', ['openpyxl', 'xlsxwriter'])
+def test_workbook_writes_non_finite_values(engine, tmp_path):
+    pytest.importorskip(engine)
+    openpyxl = pytest.importorskip('openpyxl')
+    # a contract shorter than half a month and one with a zero limit
+    df = pd.DataFrame({'po': ['P1', 'P2', 'P3'],
+                       'desired_burn_rate': [float('inf'), 5.0, float('nan')],
+                       'pct_spent': pd.array([1.5, -float('inf'), 2.0], dtype='float32')},
+                      index=pd.DatetimeIndex(pd.to_datetime(['2026-10-01'] * 3),
+                                             name='MB START'))
+    filename = contract_parser.write_watchlist_workbook(
+        str(tmp_path / 'fleet.xlsx'), {'high burn rate': df}, engine=engine)
+    rows = list(openpyxl.load_workbook(filename).active.values)
+    assert rows[0] == ('MB START', 'po', 'desired_burn_rate', 'pct_spent')
+    assert [row[1:] for row in rows[1:]] == [('P1', 'inf', 1.5), ('P2', 5, '-inf'),
+                                            ('P3', None, 2)]
+
+def test_pooled_memos_create_their_folder(project_dir, tmp_path):
+    contracts = pd.DataFrame({
+        'po': ['P{}'.format(i) for i in range(16)], 'description': 'Test contract',
+        'division': 'Fleet', 'burn_status': 'high', 'months_left': 5, 'pct_spent': 80.0,
+        'mb_$_limit': 1000, 'mb_end': pd.to_datetime(['2027-01-01'] * 16)})
+    folder = str(tmp_path / 'memos' / 'fleet')
+    filenames = contract_parser.generate_pdfs(contracts=contracts, workers=4, folder=folder)
+    assert len(filenames) == 16 and all(os.path.exists(name) for name in filenames)
+
+def test_excel_floats_round_float32_to_its_significant_digits():
+    df = pd.DataFrame({'rate': np.array([112.37611, 0.1, 12345.678, -3.3333333, 123456789.,
+                                         0, float('inf'), float('nan')], dtype='float32'),
+                       'po': list('abcdefgh')})
+    widened = contract_parser._excel_floats(df)
+    assert widened['rate'].dtype == np.float64
+    assert widened['rate'].tolist()[:-1] == [112.3761, 0.1, 12345.68, -3.333333, 123456800.0,
+                                             0, float('inf')]
+    assert np.isnan(widened['rate'].iloc[-1])
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+import calculations
+import contract_store
+import fetcher
+from conftest import NOW
+
+def _parity(contracts):
+    expected = calculations.run_spending_formulas(
+        calculations.run_duration_formulas(contracts.copy(), now=NOW))
+    expected = expected[expected['mb_end'] > NOW]
+    with contract_store.ContractStore() as store:
+        store.load(contracts, now=NOW)
+        computed = store.computed()
+    # the dtypes of calculations.ContractBook.computed
+    book = fetcher.apply_schema(fetcher.apply_schema(expected.copy()), calculations.FORMULA_SCHEMA)
+    assert list(computed.columns) == list(book.columns)
+    assert computed.dtypes.to_dict() == book.dtypes.to_dict()
+    assert computed.index.dtype == book.index.dtype
+    assert list(computed['po']) == list(expected['po'])
+    assert (computed.index == expected.index).all()
+    for col in ('duration_months', 'months_left', 'months_passed', 'burn_status',
+                'watch_list_75%_spent'):
+        assert list(computed[col]) == list(expected[col]), col
+    for col in ('pct_spent', 'desired_burn_rate', 'burn_rate'):
+        assert np.allclose(computed[col].astype(float), expected[col].astype(float),
+                           equal_nan=True), col
+    # NaT where the estimate is beyond the range of timestamps
+    projected = [pd.Series(df['projected_limit_date'].values, dtype='datetime64[ns]')
+                 for df in (computed, expected)]
+    assert projected[0].equals(projected[1])
+    return computed
+
+def test_views_match_formulas(make_contracts):
+    _parity(make_contracts(300))
+
+def test_views_match_formulas_on_zero_divisors(make_contracts):
+    contracts = make_contracts(8)
+    day = pd.Timedelta(days=1)
+    start = contracts.index.values.copy()
+    contracts['mb_end'] = NOW + 300 * day
+    # a contract shorter than half a month: duration_months 0
+    start[0] = NOW - 2 * day
+    contracts.iloc[0, contracts.columns.get_loc('mb_end')] = NOW + 8 * day
+    # zero limits with and without spending
+    contracts.iloc[[1, 2], contracts.columns.get_loc('mb_$_limit')] = 0
+    contracts.iloc[[1, 2], contracts.columns.get_loc('mb_$_spent')] = [500, 0]
+    # a contract starting in a few days: months_passed 0
+    start[3] = NOW + 3 * day
+    contracts.index = pd.DatetimeIndex(start, name='MB START')
+    computed = _parity(contracts).set_index('po')
+    short, overspent, unused, future = computed.loc[contracts['po'].iloc[:4]].to_dict('records')
+    assert short['duration_months'] == 0
+    assert np.isinf(short['desired_burn_rate']) and short['burn_status'] == 'low'
+    assert np.isinf(overspent['pct_spent']) and np.isinf(overspent['burn_rate'])
+    assert np.isnan(unused['pct_spent']) and np.isnan(unused['burn_rate'])
+    assert future['months_passed'] == 0
+
+def test_watchlists_match_contract_parser(make_contracts):
+    import contract_parser
+    contracts = make_contracts(300)
+    expected = contract_parser.partition_watchlists(calculations.run_spending_formulas(
+        calculations.run_duration_formulas(contracts.copy(), now=NOW)).query('mb_end > @NOW'))
+    with contract_store.ContractStore() as store:
+        store.load(contracts, now=NOW)
+        partitions = store.partitions()
+    assert list(partitions) == list(expected)
+    for division, sheets in expected.items():
+        assert list(partitions[division]) == list(sheets)
+        for name, flagged in sheets.items():
+            assert list(partitions[division][name]['po']) == list(flagged['po'])
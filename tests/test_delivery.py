@@ -0,0 +1,59 @@
+import asyncio
+import socket
+from email.mime.text import MIMEText
+
+import pytest
+
+import delivery
+import transport
+
+pytest.importorskip('aiosmtpd')
+
+class RecordingHandler(transport.SinkHandler):
+    """
+    Sink that refuses bad@ recipients and records the most messages it was
+    answering at once.
+    """
+    def __init__(self, latency):
+        transport.SinkHandler.__init__(self, latency)
+        self.active = self.most_active = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bad@'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.active += 1
+        self.most_active = max(self.most_active, self.active)
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def test_deliver_concurrently_with_per_message_results():
+    port = _free_port()
+    handler = RecordingHandler(latency=.2)
+    server = transport.local_smtp_server(port=port, handler=handler)
+    outbox = []
+    for i, to in enumerate(['fleet@example.org'] * 6 + ['bad@example.org']):
+        msg = MIMEText('message {}'.format(i))
+        msg['From'], msg['To'], msg['Subject'] = 'sender@example.org', to, str(i)
+        outbox.append(('division {}'.format(i), msg, ['file{}.xlsx'.format(i)]))
+    try:
+        with transport.SMTPTransport('localhost', port, starttls=False) as mail:
+            results = delivery.deliver(outbox, mail, concurrency=3, retries=2, backoff=.01)
+    finally:
+        server.stop()
+    assert [result.key for result in results] == [key for key, msg, files in outbox]
+    assert [result.sent for result in results] == [True] * 6 + [False]
+    # a refused recipient is permanent and not retried
+    assert results[-1].attempts == 1
+    assert len(handler.messages) == 6
+    assert 1 < handler.most_active <= 3
@@ -0,0 +1,65 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import benchmark
+import fetcher
+from conftest import NOW
+
+def _cache_sheet(args):
+    cache_dir, agency = args
+    df = pd.DataFrame({'po': ['{}-{}'.format(agency, i) for i in range(200)]},
+                      index=pd.date_range('2020-01-01', periods=200, name='MB START'))
+    fetcher._write_cache(cache_dir, 'key-{}'.format(agency), df,
+                         source=('{}.xlsx'.format(agency), 'master', 'MB START'))
+    return fetcher._read_cache(cache_dir, 'key-{}'.format(agency)) is not None
+
+def test_concurrent_cache_writes_keep_every_entry(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    agencies = ['A{}'.format(i) for i in range(16)]
+    with ProcessPoolExecutor(max_workers=8) as pool:
+        assert all(pool.map(_cache_sheet, [(cache_dir, agency) for agency in agencies]))
+    with open(os.path.join(cache_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == sorted('key-{}'.format(agency) for agency in agencies)
+    assert fetcher.clear_cache(cache_dir) == len(agencies)
+
+def _read_while_refreshed(args):
+    cache_dir, worker = args
+    df = pd.DataFrame({'po': ['P{}'.format(i) for i in range(5000)]},
+                      index=pd.date_range('2020-01-01', periods=5000, name='MB START'))
+    for _ in range(20):
+        if worker % 2: # refresh the entry, as refresh=True does
+            fetcher._write_cache(cache_dir, 'key', df, source=('a.xlsx', 'master', 'MB START'))
+        else:
+            cached = fetcher._read_cache(cache_dir, 'key')
+            if cached is not None and not cached.equals(df):
+                return False
+    return True
+
+def test_unlocked_reads_see_whole_refreshed_entries(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=6) as pool:
+        assert all(pool.map(_read_while_refreshed, [(cache_dir, i) for i in range(6)]))
+    assert fetcher._read_cache(cache_dir, 'key') is not None
+
+def test_refreshed_entry_stays_cached(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    df = pd.DataFrame({'po': ['P1']}, index=pd.DatetimeIndex(['2020-01-01'], name='MB START'))
+    for _ in range(2): # refresh=True writes the same key again
+        fetcher._write_cache(cache_dir, 'key', df, source=('a.xlsx', 'master', 'MB START'))
+    assert fetcher._read_cache(cache_dir, 'key')['po'].tolist() == ['P1']
+
+def test_streaming_reader_matches_read_excel(tmp_path):
+    filename = benchmark.write_synthetic_workbook(str(tmp_path / 'list.xlsx'), 500, now=NOW)
+    chunks = list(fetcher.stream_contractmgmt_chunks(filename, chunksize=64, now=NOW))
+    assert all(len(chunk) <= 64 for chunk in chunks)
+    streamed = pd.concat(chunks)
+    expected = fetcher.format_column_names(pd.read_excel(filename, index_col='MB START'))
+    expected = expected[expected['mb_end'] > NOW][streamed.columns]
+    assert len(streamed) == len(expected) > 0
+    assert (streamed.index == expected.index).all()
+    for col in streamed.columns:
+        assert streamed[col].tolist() == expected[col].tolist(), col
@@ -0,0 +1,57 @@
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import calculations
+import forecast
+from conftest import NOW
+
+def _contracts(limit, spent, months_passed, months_left):
+    return pd.DataFrame({'po': ['P{}'.format(i) for i in range(len(limit))],
+                         'mb_$_limit': limit, 'mb_$_spent': spent,
+                         'months_passed': months_passed, 'months_left': months_left})
+
+def test_exhaustion_and_change_orders():
+    # burn 100 a month with 600 of headroom, 10 months to go
+    contracts = _contracts([1200, 1200, 1200], [600, 1300, 0], [6, 6, 6], [10, 10, 10])
+    scenarios = OrderedDict([('flat', (1.0, 0)), ('+20% from month 3', (1.2, 3))])
+    result = forecast.forecast(contracts, scenarios, now=NOW)
+    assert result.exhaustion_months.tolist() == [[7, 6], [0, 0], [-1, -1]]
+    assert np.allclose(result.change_orders[0], [400, 400 + 0.2 * 700])
+    assert np.allclose(result.change_orders[2], 0)
+    assert pd.Timestamp(result.exhaustion_dates[0, 0]) == NOW + pd.DateOffset(months=7)
+    assert np.isnat(result.exhaustion_dates[2]).all()
+    assert forecast.change_order_amounts(contracts, scenarios, now=NOW).tolist() == [540, 2570, 0]
+
+def test_broadcast_matches_month_by_month(make_contracts):
+    contracts = calculations.run_spending_formulas(
+        calculations.run_duration_formulas(make_contracts(60), now=NOW))
+    contracts = contracts[contracts['months_left'] > 0]
+    scenarios = forecast.scenario_grid(.5, 2, 5, start=2)
+    result = forecast.forecast(contracts, scenarios, now=NOW, chunksize=7)
+    horizon = int(contracts['months_left'].max())
+    for i, (_, row) in enumerate(contracts.iterrows()):
+        burn = row['mb_$_spent'] / row['months_passed']
+        for s, (multiplier, start) in enumerate(scenarios.values()):
+            spent, exhausted = float(row['mb_$_spent']), -1
+            if spent >= row['mb_$_limit']:
+                exhausted = 0
+            for month in range(1, horizon + 1):
+                spent += burn * (multiplier if month > start else 1)
+                if exhausted < 0 and spent > row['mb_$_limit']:
+                    exhausted = month
+                if month == row['months_left']:
+                    at_end = spent
+            assert result.exhaustion_months[i, s] == exhausted
+            assert np.isclose(result.projected_spend[i, s], at_end)
+
+def test_contracts_not_started_raise_no_warnings():
+    # a contract starting next month has no months passed and no spend yet
+    contracts = _contracts([1200, 1200], [0, 600], [0, 6], [12, 10])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = forecast.forecast(contracts, now=NOW)
+    assert (result.exhaustion_months[0] == -1).all()
+    assert np.allclose(result.change_orders[0], 0)
@@ -0,0 +1,17 @@
+import numpy as np
+
+import metrics
+
+def test_traced_peak_is_reset_for_every_stage():
+    run_metrics = metrics.RunMetrics(trace_memory=True)
+    with run_metrics.stage('large'):
+        block = np.ones(4 * 1024 ** 2)
+        del block
+    with run_metrics.stage('small'):
+        np.ones(1024)
+    run_metrics.stop()
+    large, small = run_metrics.stages['large'], run_metrics.stages['small']
+    assert large['peak_traced_bytes'] > 32 * 1024 ** 2 > small['peak_traced_bytes']
+    # the resident high-water mark belongs to the process, not the stage
+    if large['rss_high_water_bytes'] is not None:
+        assert small['rss_high_water_bytes'] >= large['rss_high_water_bytes']
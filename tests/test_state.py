@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+import calculations
+import history
+import state
+from conftest import NOW
+
+def test_trend_columns_do_not_mark_contracts_changed(make_contracts, tmp_path):
+    contracts = calculations.run_spending_formulas(
+        calculations.run_duration_formulas(make_contracts(50), now=NOW))
+    contracts['fiscal_year'] = contracts.index.year
+    snapshots = history.SnapshotStore(str(tmp_path / 'history'))
+    with state.ContractState(str(tmp_path / 'state.sqlite')) as notified:
+        first = snapshots.append(contracts, now=NOW)
+        assert len(notified.changed(first)) == len(first)
+        notified.record(first)
+        # the same ledger a day later: the trends move, the contracts do not
+        later = snapshots.append(contracts, now=NOW + timedelta(days=1))
+        assert (later['velocity_30d'] != first['velocity_30d']).any()
+        assert len(notified.changed(later)) == 0
+        changed = later.copy()
+        changed.iloc[3, changed.columns.get_loc('mb_$_spent')] += 1
+        assert list(notified.changed(changed)['po']) == [changed['po'].iloc[3]]
@@ -0,0 +1,372 @@
+"""
+Module for the SMTP connections used to deliver contract management
+emails.  A transport opens authenticated connections lazily, keeps them
+in a small pool and reuses them for every message of a run instead of
+doing the EHLO, STARTTLS and login round trips once per email.  Dropped
+connections are replaced and the message retried once.
+
+The server is read from the [SMTP] section of configuration/config.ini
+and the credentials from the [Email] section, for example:
+    [SMTP]
+    host = smtp.gmail.com
+    port = 587
+    starttls = yes
+    pool_size = 1
+
+Large attachments are sent as StreamingMessage objects, which read each
+file from disk and base64 encode it line by line straight into the SMTP
+DATA stream, so a message is never held in memory as a whole.
+
+For offline testing, run a local debugging server that prints every
+message it receives and point the [SMTP] section at it
+(host = localhost, port = 8025, starttls = no, login = no):
+    $ python transport.py
+"""
+import asyncio
+import base64
+import configparser
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email.header import Header
+from email.mime.text import MIMEText
+
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.handlers import Debugging
+except ImportError: # local test server unavailable
+    Controller = None
+
+class SMTPTransport(object):
+    """
+    Pool of reusable, authenticated SMTP connections.
+    -------------------------------------------------
+    example:
+        with SMTPTransport.from_config() as mail:
+            for msg in messages:
+                mail.send(msg)
+    """
+    def __init__(self, host='smtp.gmail.com', port=587, username=None, password=None,
+                 starttls=True, pool_size=1, timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config=None, path='configuration/config.ini'):
+        """
+        Create a transport from a ConfigParser (read from path if not given).
+        Without an [SMTP] section the Gmail server used by the program is
+        assumed.
+        """
+        if config is None:
+            config = configparser.ConfigParser()
+            config.read(path)
+        smtp = config['SMTP'] if config.has_section('SMTP') else config['DEFAULT']
+        login = smtp.getboolean('login', True)
+        return cls(host=smtp.get('host', 'smtp.gmail.com'),
+                   port=smtp.getint('port', 587),
+                   username=config['Email']['email_address'] if login else None,
+                   password=config['Email']['password'] if login else None,
+                   starttls=smtp.getboolean('starttls', True),
+                   pool_size=smtp.getint('pool_size', 1))
+
+    def _connect(self):
+        """
+        Open and authenticate a new connection.
+        """
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        connection.ehlo()
+        if self.starttls:
+            connection.starttls()
+            connection.ehlo()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _acquire(self):
+        """
+        Return an idle connection, opening one while the pool has room and
+        otherwise waiting for a connection to be released.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            room = self._opened < self.pool_size
+            if room:
+                self._opened += 1
+        if room:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return self._idle.get(timeout=self.timeout)
+
+    def _release(self, connection):
+        self._idle.put(connection)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._opened -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def send(self, msg, sender=None, recipients=None):
+        """
+        Send an email.message.Message or a StreamingMessage over a pooled
+        connection.  sender and recipients default to the message's From and
+        To headers.  If the server dropped the connection it is reopened and
+        the message sent again once.
+        """
+        sender = sender or msg['From']
+        recipients = recipients or msg['To']
+        for attempt in (1, 2):
+            connection = self._acquire()
+            try:
+                if isinstance(msg, StreamingMessage):
+                    result = _send_streaming(connection, sender, recipients, msg)
+                else:
+                    result = connection.sendmail(sender, recipients, msg.as_string())
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._discard(connection)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                # connection may be mid transaction, start the next send fresh
+                self._discard(connection)
+                raise
+            self._release(connection)
+            return result
+
+    def close(self):
+        """
+        Quit every idle connection in the pool.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                connection.quit()
+            except Exception:
+                connection.close()
+            with self._lock:
+                self._opened -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class StreamingMessage(object):
+    """
+    Multipart email with a plain text body and file attachments that are
+    read and base64 encoded only while the message is being sent.
+    -------------------------------------------------------------------
+    It offers the parts of the email.message.Message interface the program
+    uses: header lookup with msg['To'], as_bytes() and as_string().  The
+    transport sends it line by line with iter_lines() so memory use does
+    not grow with the size of the attachments.
+
+    example:
+        msg = StreamingMessage('ap@example.org', 'fleet@example.org',
+                               'Fleet Contract Management Watchlist',
+                               'Attached please find...',
+                               ['temporary_workbooks_folder/fleet-blankets-05-15-18.xlsx'])
+    """
+    # bytes read per chunk, a multiple of 57 so each chunk encodes to whole
+    # 76 character base64 lines
+    chunk_bytes = 57 * 1024
+
+    def __init__(self, sender, recipient, subject, body, attachments=()):
+        self.headers = [('To', recipient), ('From', sender), ('Subject', subject)]
+        self.body = body
+        self.attachments = list(attachments)
+        self.boundary = '==============={}=='.format(uuid.uuid4().hex)
+
+    def __getitem__(self, name):
+        for header, value in self.headers:
+            if header.lower() == name.lower():
+                return value
+        return None
+
+    def _head(self):
+        lines = ['Content-Type: multipart/mixed; boundary="{}"'.format(self.boundary),
+                 'MIME-Version: 1.0']
+        for name, value in self.headers:
+            try:
+                value.encode('ascii')
+            except UnicodeEncodeError:
+                value = Header(value, 'utf-8').encode()
+            lines.append('{}: {}'.format(name, value))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+    def _body_part(self):
+        text = MIMEText(self.body).as_bytes().replace(b'\n', b'\r\n')
+        return '--{}\r\n'.format(self.boundary).encode('ascii') + text + b'\r\n'
+
+    def _attachment_head(self, path):
+        return ('--{}\r\nContent-Type: application/octet-stream\r\nMIME-Version: 1.0\r\n'
+                'Content-Transfer-Encoding: base64\r\n'
+                'Content-Disposition: attachment; filename={}\r\n\r\n').format(
+                    self.boundary, os.path.basename(path)).encode('utf-8')
+
+    def iter_lines(self):
+        """
+        Yield the encoded message one CRLF terminated line at a time,
+        reading each attachment from disk one chunk at a time.
+        """
+        for part in (self._head(), self._body_part()):
+            for line in part.splitlines(True):
+                yield line
+        for path in self.attachments:
+            for line in self._attachment_head(path).splitlines(True):
+                yield line
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.chunk_bytes)
+                    if not chunk:
+                        break
+                    for line in base64.encodebytes(chunk).splitlines():
+                        yield line + b'\r\n'
+        yield '--{}--\r\n'.format(self.boundary).encode('ascii')
+
+    def size(self):
+        """
+        Return the size in bytes of the encoded message without encoding it.
+        """
+        total = len(self._head()) + len(self._body_part()) + len(self.boundary) + 6
+        for path in self.attachments:
+            total += len(self._attachment_head(path)) + encoded_size(os.path.getsize(path))
+        return total
+
+    def as_bytes(self):
+        return b''.join(self.iter_lines())
+
+    def as_string(self):
+        return self.as_bytes().decode('utf-8')
+
+def encoded_size(nbytes):
+    """
+    Return the bytes taken by nbytes of data once base64 encoded in 76
+    character CRLF terminated lines.
+    """
+    chars = -(-nbytes // 3) * 4
+    return chars + -(-chars // 76) * 2
+
+def split_attachments(files, max_bytes, overhead=16 * 1024):
+    """
+    Function groups files, in order, into batches whose encoded size plus
+    overhead bytes for headers and body stays within max_bytes so each batch
+    can be sent as one message.  A file too large on its own gets a batch to
+    itself.  Returns a list of lists of files.
+    """
+    batches, batch, used = [], [], overhead
+    for path in files:
+        size = encoded_size(os.path.getsize(path)) + 256 # part headers
+        if batch and used + size > max_bytes:
+            batches.append(batch)
+            batch, used = [], overhead
+        batch.append(path)
+        used += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _send_streaming(connection, sender, recipients, msg, buffer_bytes=64 * 1024):
+    """
+    Send a StreamingMessage over an smtplib connection, writing the DATA
+    stream in buffered pieces.  Returns the refused recipients like
+    smtplib.SMTP.sendmail().
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    connection.ehlo_or_helo_if_needed()
+    code, response = connection.mail(sender)
+    if code != 250:
+        connection.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+    refused = {}
+    for recipient in recipients:
+        code, response = connection.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(recipients):
+        connection.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = connection.docmd('data')
+    if code != 354:
+        connection.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    pending, size = [], 0
+    for line in msg.iter_lines():
+        if line.startswith(b'.'):
+            line = b'.' + line # dot stuffing
+        pending.append(line)
+        size += len(line)
+        if size >= buffer_bytes:
+            connection.send(b''.join(pending))
+            pending, size = [], 0
+    pending.append(b'.\r\n')
+    connection.send(b''.join(pending))
+    code, response = connection.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+class SinkHandler(object):
+    """
+    aiosmtpd handler that accepts and keeps every message, optionally waiting
+    latency seconds before answering each one to stand in for a slow server.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+def local_smtp_server(host='localhost', port=8025, handler=None):
+    """
+    Start a local SMTP server in a background thread (requires aiosmtpd) and
+    return its controller; call .stop() on it when done.  The default handler
+    prints each message received; pass SinkHandler() to collect them instead.
+    """
+    if Controller is None:
+        raise ImportError('the local SMTP server requires the aiosmtpd package')
+    controller = Controller(handler or Debugging(), hostname=host, port=port)
+    controller.start()
+    return controller
+
+
+if __name__ == '__main__':
+    server = local_smtp_server()
+    print('debugging SMTP server on {}:{}, ctrl-c to stop'.format(server.hostname, server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -3,10 +3,50 @@ Module for managing file and storage size of
 the temporary folder for longterm use of the program
 and easily identifying which contract management
 watchlists failed to send to target divisions.
+
+ArtifactManager extends this to every folder the program writes reports
+to: it records which files each run generated, sent and failed to send in
+a manifest, deletes sent files and applies retention by age and total size
+so the folders cannot grow without bound.  Each folder is read with a
+single os.scandir pass and files are matched against sets, so the cost of
+a cleanup grows with the files in the folders only, not files x sent.
 """
+import json
 import os
+import time
+from datetime import datetime as dt
+
+# folders holding program generated reports, subfolders included
+ARTIFACT_FOLDERS = ['temporary_workbooks_folder', 'changeorder_memos']
+ARTIFACT_MANIFEST = 'artifact_manifest.jsonl'
+
+def _scan(folder):
+    """
+    Yield an os.DirEntry for every file under folder, walking subfolders
+    with os.scandir and skipping hidden entries like .files.
+    """
+    pending = [folder]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
 
-def clean_temporary_folder(outbound_files):
+def _paths(files):
+    """
+    Return a set of normalized paths for comparing against scanned entries.
+    """
+    return set(os.path.normpath(path) for path in files)
+
+def clean_temporary_folder(outbound_files, folder='temporary_workbooks_folder'):
     """
     Function removes files from the temporary folder if they have been
     sent via email. Primary purposes of this function are to:
@@ -16,18 +56,135 @@ def clean_temporary_folder(outbound_files):
         date and file
 
     The program checks for and deletes sucessfully sent excel workbooks from
-    'temporary_workbooks_folder'
+    folder, by default 'temporary_workbooks_folder'
     """
-    before = len(os.listdir('temporary_workbooks_folder/'))
-    for item in os.listdir('temporary_workbooks_folder/'):
-        # keep non-file objects like .files
-        if os.path.isfile('temporary_workbooks_folder/{}'.format(item)) == False:
-            pass
-        else:
-            if 'temporary_workbooks_folder/{}'.format(item) in outbound_files:
-                os.remove('temporary_workbooks_folder/{}'.format(item))
+    sent = _paths(outbound_files)
+    deleted = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            # keep non-file objects like .files
+            if entry.is_file() and os.path.normpath(entry.path) in sent:
+                os.remove(entry.path)
+                deleted += 1
+    print('{} files deleted'.format(deleted))
+
+    return deleted
+
+class ArtifactManager(object):
+    """
+    Lifecycle of the workbooks and memos generated by a run.
+    --------------------------------------------------------
+    Files are recorded as generated, sent or failed during the run, then
+    clean() deletes the sent files, expires files older than max_age_days
+    and, while the folders hold more than max_bytes, deletes the oldest
+    files.  Files that failed to send in this run are never deleted by the
+    size limit so they can be resent.  clean() appends a line describing the
+    run to the JSON lines manifest.
+
+        example:
+            artifacts = ArtifactManager()
+            artifacts.record(generated=workbooks + memos, sent=sent, failed=failed)
+            artifacts.clean()
+    """
+    def __init__(self, folders=ARTIFACT_FOLDERS, manifest=ARTIFACT_MANIFEST,
+                 max_age_days=30, max_bytes=1024 ** 3):
+        self.folders = list(folders)
+        self.manifest = manifest
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.generated, self.sent, self.failed = set(), set(), set()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Create a manager with the retention options of the [Artifacts]
+        section of a ConfigParser: max_age_days and max_megabytes.
+        """
+        if config.has_section('Artifacts'):
+            section = config['Artifacts']
+            kwargs.setdefault('max_age_days', section.getfloat('max_age_days', 30))
+            kwargs.setdefault('max_bytes', int(section.getfloat('max_megabytes', 1024) *
+                                               1024 ** 2))
+        return cls(**kwargs)
+
+    def record(self, generated=(), sent=(), failed=()):
+        """
+        Add files to the run's generated, sent and failed sets.  A file sent
+        after failing is only counted as sent.
+        """
+        self.generated |= _paths(generated)
+        self.sent |= _paths(sent)
+        self.failed = (self.failed | _paths(failed)) - self.sent
+
+    def record_deliveries(self, results):
+        """
+        Record the files of a list of delivery.DeliveryResult as sent or failed.
+        """
+        self.record(sent=[file for result in results if result.sent for file in result.files],
+                    failed=[file for result in results if not result.sent
+                            for file in result.files])
+
+    def clean(self, now=None):
+        """
+        Function deletes the sent files and applies the retention limits in
+        one scan of the artifact folders, appends the run to the manifest
+        and returns a dict with the number of files deleted for each reason
+        and the files and bytes kept.
+        """
+        now = time.time() if now is None else now
+        expires = now - self.max_age_days * 86400 if self.max_age_days is not None else None
+        removed = {'sent': [], 'expired': [], 'over size': []}
+        kept = []
+        for folder in self.folders:
+            for entry in _scan(folder):
+                path = os.path.normpath(entry.path)
+                stat = entry.stat()
+                if path in self.sent:
+                    reason = 'sent'
+                elif expires is not None and stat.st_mtime < expires:
+                    reason = 'expired'
+                else:
+                    kept.append((stat.st_mtime, stat.st_size, path))
+                    continue
+                self._remove(path, removed[reason])
+
+        total = sum(size for mtime, size, path in kept)
+        if self.max_bytes is not None and total > self.max_bytes:
+            survivors = []
+            for mtime, size, path in sorted(kept):
+                if total > self.max_bytes and path not in self.failed:
+                    if self._remove(path, removed['over size']):
+                        total -= size
+                        continue
+                survivors.append((mtime, size, path))
+            kept = survivors
+
+        summary = dict((reason, len(paths)) for reason, paths in removed.items())
+        summary.update(kept=len(kept), bytes=total)
+        self._append_manifest(removed, summary)
+        print('{sent} sent, {expired} expired and {over size} over size files deleted, '
+              '{kept} files ({bytes:,} bytes) kept'.format(**summary))
+        return summary
 
-    after = len(os.listdir('temporary_workbooks_folder/'))
-    print('{} files deleted'.format(before - after))
+    @staticmethod
+    def _remove(path, removed):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        removed.append(path)
+        return True
 
-    return (before - after)
+    def _append_manifest(self, removed, summary):
+        """
+        Append one JSON line describing the run to the manifest.
+        """
+        if not self.manifest:
+            return
+        entry = {'run': dt.now().isoformat(timespec='seconds'),
+                 'generated': sorted(self.generated), 'sent': sorted(self.sent),
+                 'failed': sorted(self.failed),
+                 'removed': dict((reason, sorted(paths)) for reason, paths in removed.items()),
+                 'kept': summary['kept'], 'bytes': summary['bytes']}
+        with open(self.manifest, 'a') as f:
+            f.write(json.dumps(entry) + '\n')